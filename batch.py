@@ -0,0 +1,311 @@
+#batch
+
+# Command line converter for whole directories of WeaveMaker files.
+#  - walks the input tree looking for wmd/wmdf files,
+#  - converts every colorway of each file to a wif, over a pool of processes,
+#  - writes the wifs into an output tree mirroring the input tree.
+# A file that fails to convert is reported, the rest of the batch carries on.
+# The input can also be a zip or tar archive, its members are converted without
+# extracting them, and the output can be a zip (name ending .zip) instead of a directory.
+# Large files are memory mapped rather than read.
+#
+# Usage:
+#   python batch.py input_dir output_dir [-j jobs] [--cache cache_dir]
+#   python batch.py bundle.tar.gz wifs.zip
+
+import os
+import sys
+import json
+import mmap
+import time
+import tarfile
+import zipfile
+import argparse
+import posixpath
+from concurrent.futures import ProcessPoolExecutor
+
+from weavemaker import read_weavemaker, parse_wmdf, WMDF, WMDFParser, Profile
+from wif_cache import ConversionCache
+from conversion import unique_name
+
+extensions = (".wmd", ".wmdf")
+archive_extensions = (".zip", ".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tbz2", ".tar.xz", ".txz")
+mmap_threshold = 4 * 1024 * 1024  # files larger than this are mapped, not read
+chunk_size = 65536  # archive members are parsed this much at a time
+caches = {}  # cache directory: ConversionCache, one set per worker process
+archives = {}  # zip archive path: open ZipFile, one set per worker process
+
+
+def find_weavemaker_files(root):
+    """
+    Yield the path of every wmd/wmdf file below root.
+    - sorted so that repeated runs process files in the same order
+    """
+    if os.path.isfile(root):
+        yield root
+        return
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for f in sorted(filenames):
+            if f.lower().endswith(extensions):
+                yield os.path.join(dirpath, f)
+
+def is_archive(path):
+    return os.path.isfile(path) and path.lower().endswith(archive_extensions)
+
+def zip_members(archive):
+    """ Names of the wmd/wmdf files in a zip archive """
+    with zipfile.ZipFile(archive) as z:
+        return [info.filename for info in z.infolist()
+                if not info.is_dir() and info.filename.lower().endswith(extensions)]
+
+def tar_members(archive):
+    """
+    Yield (member name, binary file object) for each wmd/wmdf file in a tar archive.
+    - read front to back as a stream (compressed or not), each file object
+      is only good until the next member
+    """
+    with tarfile.open(archive, 'r|*') as t:
+        for member in t:
+            if member.isfile() and member.name.lower().endswith(extensions):
+                yield member.name, t.extractfile(member)
+
+def member_folder(member):
+    """
+    Folder of an archive member, relative to the archive's root.
+    - raises ValueError for absolute names or ones with '..', which would write outside the output
+    """
+    name = member.replace("\\", "/")
+    parts = name.split("/")
+    if name.startswith("/") or (len(name) > 1 and name[1] == ":") or ".." in parts:
+        raise ValueError(f"unsafe path in archive: {member}")
+    folder = posixpath.dirname(posixpath.normpath(name))
+    return "" if folder == "." else folder
+
+def output_dir_for(src, src_root, dst_root):
+    """ The directory in dst_root mirroring the one src is in """
+    if isinstance(src, tuple):  # (archive, member)
+        path = os.path.normpath(os.path.join(dst_root, member_folder(src[1])))
+        root = os.path.abspath(dst_root)
+        if os.path.commonpath([root, os.path.abspath(path)]) != root:
+            raise ValueError(f"unsafe path in archive: {src[1]}")
+        return path
+    if os.path.isfile(src_root):
+        return dst_root
+    relative = os.path.relpath(os.path.dirname(src), src_root)
+    return os.path.normpath(os.path.join(dst_root, relative))
+
+def describe(src):
+    """ src for reports, archive members as archive:member """
+    return ":".join(src) if isinstance(src, tuple) else src
+
+def read_input(src):
+    """ Contents of the file at src, memory mapped if it is large """
+    if os.path.getsize(src) <= mmap_threshold:
+        return read_weavemaker(src)
+    with open(src, 'rb') as f:
+        # the map outlives the file, and the segments parsed from it point into it
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+def cache_for(cache_dir):
+    if cache_dir not in caches:
+        caches[cache_dir] = ConversionCache(directory=cache_dir)
+    return caches[cache_dir]
+
+def convert_contents(contents, filename, cache_dir=None, profile=None):
+    """ [[wif_filename, wif], ...] for every colorway in contents """
+    if cache_dir:
+        return cache_for(cache_dir).get_wifs(contents, filename)
+    data, colors = parse_wmdf(contents, profile=profile)
+    return WMDF(data, colors, filename, profile=profile).make_wifs()  # all colorways
+
+def convert_stream(fileobj, filename, cache_dir=None, profile=None):
+    """
+    (bytes read, [[wif_filename, wif], ...]) for a binary file object such as an archive member.
+    - parsed while it is read, unless the cache needs all the contents for its key
+    """
+    if cache_dir:
+        contents = fileobj.read()
+        return len(contents), convert_contents(contents, filename, cache_dir)
+    parser = WMDFParser(profile=profile)
+    while True:
+        chunk = fileobj.read(chunk_size)
+        if not chunk:
+            break
+        parser.feed(chunk)
+    data, colors = parser.close()
+    return parser.size, WMDF(data, colors, filename, profile=profile).make_wifs()
+
+def write_wifs(wifs, dst_dir):
+    """ Write [[wif_filename, wif], ...] into dst_dir, returns the paths written """
+    os.makedirs(dst_dir, exist_ok=True)
+    written = []
+    for wif_filename, wif in wifs:
+        path = os.path.join(dst_dir, wif_filename)
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(wif)
+        written.append(path)
+    return written
+
+def convert_file(src, dst_dir, cache_dir=None, profile=None):
+    """
+    Convert every colorway found in src, writing the wifs into dst_dir.
+    - src is a path, or (zip archive, member name)
+    - dst_dir None returns the [[wif_filename, wif], ...] instead of writing them
+    - cache_dir: reuse (and keep) conversions in a ConversionCache there
+    - profile: a Profile to time the conversion in (cache hits are not timed)
+    - returns (bytes read, list of wif paths written)
+    """
+    if isinstance(src, tuple):
+        archive, member = src
+        if archive not in archives:
+            archives[archive] = zipfile.ZipFile(archive)
+        with archives[archive].open(member) as f:
+            size, wifs = convert_stream(f, posixpath.basename(member), cache_dir, profile)
+    else:
+        contents = read_input(src)
+        size = len(contents)
+        wifs = convert_contents(contents, os.path.basename(src), cache_dir, profile)
+    if dst_dir is None:
+        return size, wifs
+    return size, write_wifs(wifs, dst_dir)
+
+def convert_job(job):
+    """
+    Worker process entry point.
+    - never raises, so one bad file cannot stop the batch
+    - returns (src, bytes read, wifs written, error message or None, profile dict or None)
+    """
+    src, dst_dir, cache_dir, profiled = job
+    profile = Profile() if profiled else None
+    try:
+        size, written = convert_file(src, dst_dir, cache_dir, profile)
+        return src, size, written, None, profile and profile.as_dict()
+    except Exception as e:
+        return src, 0, [], f"{type(e).__name__}: {e}", profile and profile.as_dict()
+
+def convert_tar(archive, dst_root, cache_dir=None, to_zip=False, profiled=False):
+    """
+    Yield convert_job results for each member of a tar archive, in this process.
+    - a tar can only be read front to back, so its members are converted as they stream past
+    """
+    for member, f in tar_members(archive):
+        src = (archive, member)
+        profile = Profile() if profiled else None
+        try:
+            dst_dir = output_dir_for(src, archive, dst_root)  # refuses unsafe member names
+            size, wifs = convert_stream(f, posixpath.basename(member), cache_dir, profile)
+            written = wifs if to_zip else write_wifs(wifs, dst_dir)
+            yield src, size, written, None, profile and profile.as_dict()
+        except Exception as e:
+            yield src, 0, [], f"{type(e).__name__}: {e}", profile and profile.as_dict()
+
+def run_batch(src_root, dst_root, jobs=None, verbose=False, cache_dir=None, profiled=False):
+    """
+    Convert all files below src_root (a directory, file or archive) into dst_root.
+    - dst_root ending in .zip writes the wifs into that zip rather than a directory
+    - jobs is the number of worker processes (default: one per core)
+    - cache_dir keeps conversions so unchanged files are not converted again
+    - profiled times every stage of every conversion, summed in totals["profile"]
+    - returns a dict of totals for reporting
+    """
+    jobs = jobs or os.cpu_count() or 1
+    to_zip = dst_root.lower().endswith(".zip")
+    tar = is_archive(src_root) and not zipfile.is_zipfile(src_root)
+    if tar:
+        sources = []
+    elif is_archive(src_root):
+        sources = [(src_root, member) for member in zip_members(src_root)]
+    else:
+        sources = list(find_weavemaker_files(src_root))
+    work = []
+    rejected = []  # archive members whose names would write outside dst_root
+    for src in sources:
+        try:
+            dst_dir = output_dir_for(src, src_root, dst_root)
+        except ValueError as e:
+            rejected.append((describe(src), str(e)))
+            print(f"!!FAIL: {describe(src)}: {e}", file=sys.stderr)
+            continue
+        work.append((src, None if to_zip else dst_dir, cache_dir, profiled))
+    totals = {"files": len(sources), "converted": 0, "wifs": 0, "bytes": 0, "failures": rejected}
+    profile = Profile() if profiled else None
+    start = time.perf_counter()
+    if tar:  # streamed in this process
+        jobs = 1
+        results = convert_tar(src_root, dst_root, cache_dir, to_zip, profiled)
+    elif jobs == 1:  # run in this process, easier to debug
+        results = map(convert_job, work)
+    else:
+        pool = ProcessPoolExecutor(max_workers=jobs)
+        # small chunks keep all workers busy without shipping one job at a time
+        chunksize = max(1, min(32, len(work) // (jobs * 4)))
+        results = pool.map(convert_job, work, chunksize=chunksize)
+    if to_zip:
+        if os.path.dirname(dst_root):
+            os.makedirs(os.path.dirname(dst_root), exist_ok=True)
+        output = zipfile.ZipFile(dst_root, 'w', zipfile.ZIP_DEFLATED)
+        used = set()
+    try:
+        for src, size, written, error, stages in results:
+            if tar:
+                totals["files"] += 1
+            if stages:
+                profile.add(stages)
+            if error:
+                totals["failures"].append((describe(src), error))
+                print(f"!!FAIL: {describe(src)}: {error}", file=sys.stderr)
+                continue
+            if to_zip:
+                folder = output_dir_for(src, src_root, "").replace(os.sep, "/")
+                folder = "" if folder == "." else folder
+                for wif_filename, wif in written:
+                    output.writestr(unique_name(posixpath.join(folder, wif_filename), used), wif)
+            totals["converted"] += 1
+            totals["wifs"] += len(written)
+            totals["bytes"] += size
+            if verbose:
+                print(f"{describe(src)} -> {len(written)} wif(s)")
+    finally:
+        if to_zip:
+            output.close()
+        if jobs != 1:
+            pool.shutdown()
+    totals["seconds"] = time.perf_counter() - start
+    if profile:
+        totals["profile"] = profile
+    return totals
+
+def report_batch(totals):
+    """ Summary lines for the end of a run """
+    seconds = max(totals["seconds"], 1e-9)
+    msg = []
+    msg.append(f"Converted {totals['converted']} of {totals['files']} files into {totals['wifs']} wifs in {totals['seconds']:.2f}s.")
+    msg.append(f" - {totals['converted']/seconds:.1f} files/s, {totals['bytes']/seconds/1e6:.2f} MB/s")
+    if totals["failures"]:
+        msg.append(f" - {len(totals['failures'])} files failed:")
+        for src, error in totals["failures"]:
+            msg.append(f"   {src}: {error}")
+    return msg
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Convert directories of WeaveMaker wmd/wmdf files to wif files.")
+    parser.add_argument("input", help="wmd/wmdf file, directory to search, or zip/tar archive")
+    parser.add_argument("output", help="directory to write the wif files into, or a .zip to write them to")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="worker processes (default: one per core)")
+    parser.add_argument("-v", "--verbose", action="store_true", help="list every file converted")
+    parser.add_argument("--cache", help="directory to keep conversions in, reused by later runs")
+    parser.add_argument("--profile", help="time every conversion stage, report them and save the totals to this JSON file")
+    args = parser.parse_args(argv)
+    totals = run_batch(args.input, args.output, args.jobs, args.verbose, args.cache, bool(args.profile))
+    print("\n".join(report_batch(totals)))
+    if args.profile:
+        print("\n".join(totals["profile"].report()))
+        with open(args.profile, 'w') as f:
+            json.dump(totals["profile"].as_dict(), f, indent=1)
+    return 1 if totals["failures"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,146 @@
+#bench
+
+# Scaling benchmark for the converter, run on synthetic files from wmdf_synth.
+# For each case in a size sweep it records, per stage:
+#  - best wall time over a number of repeats,
+#  - peak memory allocated by python (tracemalloc) in a separate run.
+# Stages: read_colors, parse_wmdf, WMDF (construction), make_wif, make_wifs (all colorways)
+# Results are written as JSON. Compare against an earlier run to catch regressions.
+#
+# Usage:
+#   python bench.py [--quick] [-o results.json] [--compare old.json] [--tolerance 1.5]
+
+import sys
+import json
+import time
+import platform
+import argparse
+import tracemalloc
+from struct import unpack_from
+
+from weavemaker import read_colors, parse_wmdf, WMDF
+from wmdf_synth import make_wmdf
+
+# The sweep: (name, wmdf_synth options)
+sweep = []
+for shafts in [8, 32, 40, 150]:
+    for threads in [200, 2000, 20000]:
+        for liftplan in [False, True]:
+            mode = "lift" if liftplan else "tieup"
+            sweep.append([f"{mode}-{shafts}s-{threads}t",
+                          dict(shafts=shafts, treadles=min(shafts, 32), ends=threads, picks=threads,
+                               colorways=5, palette=40, liftplan=liftplan, noise=0.05)])
+quick_sweep = [case for case in sweep if "20000t" not in case[0] and case[1]["shafts"] in [8, 150]]
+
+
+def stages_for(contents):
+    """
+    [name, function] for each stage, each stage working from the previous one's result
+    """
+    datastart = unpack_from('>H', contents, 0)[0]
+    data, colors = parse_wmdf(contents)
+    w = WMDF(data, colors, "bench.wmdf")
+    return [["read_colors", lambda: read_colors(memoryview(contents)[2:datastart+4])],
+            ["parse_wmdf", lambda: parse_wmdf(contents)],
+            ["WMDF", lambda: WMDF(data, colors, "bench.wmdf")],
+            ["make_wif", lambda: w.make_wif(0)],
+            ["make_wifs", lambda: w.make_wifs()]]
+
+def time_stage(function, repeats):
+    """ Best wall time of repeats runs """
+    best = None
+    for i in range(repeats):
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+def peak_memory(function):
+    """ Peak python memory allocated while running function once """
+    tracemalloc.start()
+    try:
+        function()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def run_case(name, options, repeats):
+    contents = make_wmdf(**options)
+    result = {"case": name, "options": options, "bytes": len(contents), "stages": {}}
+    for stage, function in stages_for(contents):
+        result["stages"][stage] = {"seconds": time_stage(function, repeats),
+                                   "peak_bytes": peak_memory(function)}
+    return result
+
+def run_sweep(cases, repeats=3, verbose=True):
+    results = []
+    for name, options in cases:
+        result = run_case(name, options, repeats)
+        results.append(result)
+        if verbose:
+            print("\n".join(report_case(result)))
+    return {"python": sys.version.split()[0],
+            "implementation": platform.python_implementation(),
+            "machine": platform.machine(),
+            "date": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "repeats": repeats,
+            "results": results}
+
+def report_case(result):
+    msg = [f"{result['case']}  ({result['bytes']} bytes)"]
+    for stage, r in result["stages"].items():
+        msg.append(f" - {stage:<12} {r['seconds']*1000:>10.2f} ms  {r['peak_bytes']/1e6:>9.2f} MB peak")
+    return msg
+
+# changes smaller than these are timer or allocator noise
+noise_floor = {"seconds": 0.002, "peak_bytes": 65536}
+
+def compare(old, new, tolerance=1.5):
+    """
+    Stages in new that are slower, or use more memory, than tolerance times old.
+    - returns report lines, empty if no regressions
+    """
+    previous = {r["case"]: r for r in old["results"]}
+    msg = []
+    for result in new["results"]:
+        if result["case"] not in previous:
+            continue
+        for stage, r in result["stages"].items():
+            before = previous[result["case"]]["stages"].get(stage)
+            if not before:
+                continue
+            for measure in ["seconds", "peak_bytes"]:
+                grown = r[measure] - before[measure]
+                if r[measure] > before[measure] * tolerance and grown > noise_floor[measure]:
+                    msg.append(f" - {result['case']} {stage} {measure}: {before[measure]:.4g} -> {r[measure]:.4g}")
+    return msg
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the WeaveMaker converter on synthetic files.")
+    parser.add_argument("--quick", action="store_true", help="small sweep only")
+    parser.add_argument("--repeats", type=int, default=3, help="timing runs per stage (best is kept)")
+    parser.add_argument("-o", "--output", help="write results to this JSON file")
+    parser.add_argument("--compare", help="earlier results JSON to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=1.5, help="allowed slowdown/growth factor")
+    args = parser.parse_args(argv)
+    results = run_sweep(quick_sweep if args.quick else sweep, args.repeats)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=1)
+    if args.compare:
+        with open(args.compare) as f:
+            old = json.load(f)
+        regressions = compare(old, results, args.tolerance)
+        if regressions:
+            print("Regressions:")
+            print("\n".join(regressions))
+            return 1
+        print("No regressions.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
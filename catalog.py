@@ -0,0 +1,259 @@
+#catalog
+
+# Searchable index of a library of WeaveMaker drafts, kept in SQLite.
+#  - one row per file: shafts, treadles, warp/weft counts, liftplan, colorways, colors,
+#    name/version/author (or why it could not be read)
+#  - one row per segment of each file, as listed by report_fstructure
+#  - a structural fingerprint of each draft (see fingerprint.py) to find near duplicates
+# Rescans are incremental: files with the same size and mtime are not opened again,
+# files touched on disk but unchanged in content are only re-hashed.
+#
+# Usage:
+#   python catalog.py scan library_dir [--db catalog.sqlite]
+#   python catalog.py query [--shafts 16] [--liftplan] [--min-colorways 4] [--where SQL] [--db catalog.sqlite]
+#   python catalog.py similar file.wmdf [--limit 10] [--db catalog.sqlite]
+
+import os
+import sys
+import time
+import sqlite3
+import argparse
+
+from weavemaker import __version__, read_weavemaker, parse_wmdf, WMDF
+from wif_cache import content_digest
+from batch import find_weavemaker_files
+from fingerprint import draft_signature, band_keys, similarity, pack_signature, unpack_signature
+
+schema = """
+CREATE TABLE IF NOT EXISTS drafts (
+    path TEXT PRIMARY KEY,
+    mtime REAL, size INTEGER, digest TEXT, converter TEXT,
+    name TEXT, version TEXT, username TEXT,
+    shafts INTEGER, treadles INTEGER, tieup_treadles INTEGER,
+    warps INTEGER, wefts INTEGER, liftplan INTEGER,
+    colorways INTEGER, colors_used INTEGER, colors_defined INTEGER,
+    error TEXT);
+CREATE TABLE IF NOT EXISTS segments (
+    path TEXT, id TEXT, entities INTEGER, size INTEGER, bytes INTEGER,
+    PRIMARY KEY (path, id));
+CREATE TABLE IF NOT EXISTS signatures (
+    path TEXT PRIMARY KEY, signature BLOB);
+CREATE TABLE IF NOT EXISTS bands (
+    band INTEGER, bucket INTEGER, path TEXT);
+CREATE INDEX IF NOT EXISTS drafts_shafts ON drafts (shafts, liftplan);
+CREATE INDEX IF NOT EXISTS drafts_digest ON drafts (digest);
+CREATE INDEX IF NOT EXISTS bands_bucket ON bands (band, bucket);
+"""
+draft_columns = ["name", "version", "username", "shafts", "treadles", "tieup_treadles",
+                 "warps", "wefts", "liftplan", "colorways", "colors_used", "colors_defined"]
+
+
+def open_catalog(db_path):
+    """ Connection to the catalog at db_path, created if need be """
+    conn = sqlite3.connect(db_path)
+    conn.row_factory = sqlite3.Row
+    conn.executescript(schema)
+    return conn
+
+def describe_draft(contents, filename):
+    """
+    (draft columns dict, [[id, entities, size, bytes], ...], fingerprint signature) for one file.
+    - the weave, text and colorways are all decoded (the counts and fingerprint need
+      them), but no wif is built
+    """
+    data, colors = parse_wmdf(contents)
+    w = WMDF(data, colors, filename, lazy=True)
+    summary = w.summary()
+    draft = {"name": summary["name"], "version": summary["version"], "username": w.username,
+             "shafts": w.shaft_count, "treadles": w.treadle_count, "tieup_treadles": w.tieup_treadles,
+             "warps": summary["warps"], "wefts": summary["wefts"], "liftplan": int(w.liftplan),
+             "colorways": summary["colorways"],
+             "colors_used": len(w.warp_usage.indices) + len(w.weft_usage.indices),
+             "colors_defined": len(colors)}
+    segments = [[id, segment.count, segment.size, segment.length] for id, segment in data.items()]
+    return draft, segments, draft_signature(w)
+
+def store_draft(conn, path, stat, digest, contents):
+    """ Replace the catalog entry for path with what contents hold now """
+    try:
+        draft, segments, signature = describe_draft(contents, os.path.basename(path))
+        error = None
+    except Exception as e:
+        draft, segments, signature = {}, [], None
+        error = f"{type(e).__name__}: {e}"
+    values = [path, stat.st_mtime, stat.st_size, digest, __version__] + [draft.get(c) for c in draft_columns] + [error]
+    conn.execute(f"INSERT OR REPLACE INTO drafts VALUES ({','.join(['?'] * len(values))})", values)
+    conn.execute("DELETE FROM segments WHERE path = ?", (path,))
+    conn.executemany("INSERT INTO segments VALUES (?, ?, ?, ?, ?)", [[path] + s for s in segments])
+    conn.execute("DELETE FROM bands WHERE path = ?", (path,))
+    if error:
+        conn.execute("DELETE FROM signatures WHERE path = ?", (path,))
+    else:  # a draft with nothing to fingerprint is stored without a signature
+        conn.execute("INSERT OR REPLACE INTO signatures VALUES (?, ?)", (path, signature and pack_signature(signature)))
+        if signature:
+            conn.executemany("INSERT INTO bands VALUES (?, ?, ?)", [key + [path] for key in band_keys(signature)])
+    return error
+
+def forget_draft(conn, path):
+    for table in ["drafts", "segments", "signatures", "bands"]:
+        conn.execute(f"DELETE FROM {table} WHERE path = ?", (path,))
+
+def scan_library(conn, root, verbose=False):
+    """
+    Bring the catalog up to date with the files below root.
+    - returns a dict of counts for reporting
+    """
+    root = os.path.abspath(root)
+    counts = {"files": 0, "unchanged": 0, "touched": 0, "added": 0, "updated": 0, "removed": 0, "failed": 0}
+    start = time.perf_counter()
+    known = {row["path"]: row for row in conn.execute(
+        "SELECT path, mtime, size, digest, converter, error IS NOT NULL OR signatures.path IS NOT NULL AS complete"
+        " FROM drafts LEFT JOIN signatures USING (path)")}
+    seen = set()
+    with conn:
+        for path in find_weavemaker_files(root):
+            path = os.path.abspath(path)
+            seen.add(path)
+            counts["files"] += 1
+            stat = os.stat(path)
+            row = known.get(path)
+            current = row and row["converter"] == __version__ and row["complete"]
+            if current and row["size"] == stat.st_size and row["mtime"] == stat.st_mtime:
+                counts["unchanged"] += 1
+                continue
+            contents = read_weavemaker(path)
+            digest = content_digest(contents)
+            if current and row["digest"] == digest:
+                # touched, not changed
+                conn.execute("UPDATE drafts SET mtime = ?, size = ? WHERE path = ?", (stat.st_mtime, stat.st_size, path))
+                counts["touched"] += 1
+                continue
+            error = store_draft(conn, path, stat, digest, contents)
+            counts["updated" if row else "added"] += 1
+            if error:
+                counts["failed"] += 1
+                print(f"!!FAIL: {path}: {error}", file=sys.stderr)
+            elif verbose:
+                print(f"{path} catalogued")
+        # forget files gone from below root
+        inside = root if os.path.isfile(root) else root + os.sep
+        gone = [path for path in known if (path == root or path.startswith(inside)) and path not in seen]
+        for path in gone:
+            forget_draft(conn, path)
+        counts["removed"] = len(gone)
+    counts["seconds"] = time.perf_counter() - start
+    return counts
+
+def report_scan(counts):
+    msg = []
+    msg.append(f"Scanned {counts['files']} files in {counts['seconds']:.2f}s.")
+    msg.append(f" - {counts['added']} added, {counts['updated']} updated, {counts['removed']} removed")
+    msg.append(f" - {counts['unchanged']} unchanged, {counts['touched']} touched but unchanged")
+    if counts["failed"]:
+        msg.append(f" - {counts['failed']} could not be read")
+    return msg
+
+def query_drafts(conn, shafts=None, liftplan=None, min_colorways=None, segment=None, where=None):
+    """
+    Catalogued drafts matching all the filters given, as sqlite3.Rows.
+    - where is an extra SQL condition on the drafts columns
+    """
+    conditions, values = ["error IS NULL"], []
+    if shafts is not None:
+        conditions.append("shafts = ?")
+        values.append(shafts)
+    if liftplan is not None:
+        conditions.append("liftplan = ?")
+        values.append(int(liftplan))
+    if min_colorways is not None:
+        conditions.append("colorways >= ?")
+        values.append(min_colorways)
+    if segment is not None:
+        conditions.append("path IN (SELECT path FROM segments WHERE id = ?)")
+        values.append(segment)
+    if where:
+        conditions.append(f"({where})")
+    sql = f"SELECT * FROM drafts WHERE {' AND '.join(conditions)} ORDER BY path"
+    return conn.execute(sql, values).fetchall()
+
+def similar_drafts(conn, signature, limit=10, threshold=0.0):
+    """
+    [[similarity, path], ...] most similar first, for catalogued drafts sharing
+    an LSH band with signature. Nothing is parsed.
+    """
+    candidates = set()
+    for band, bucket in band_keys(signature):
+        candidates.update([r[0] for r in conn.execute("SELECT path FROM bands WHERE band = ? AND bucket = ?", (band, bucket))])
+    scored = []
+    for path in candidates:
+        blob = conn.execute("SELECT signature FROM signatures WHERE path = ?", (path,)).fetchone()[0]
+        score = similarity(signature, unpack_signature(blob))
+        if score >= threshold:
+            scored.append([score, path])
+    scored.sort(key=lambda s: (-s[0], s[1]))
+    return scored[:limit]
+
+def signature_for(conn, path):
+    """ Signature of the file at path, from the catalog if it is there and current """
+    path = os.path.abspath(path)
+    stat = os.stat(path)
+    row = conn.execute("SELECT signature FROM drafts JOIN signatures USING (path)"
+                       " WHERE path = ? AND size = ? AND mtime = ? AND converter = ?",
+                       (path, stat.st_size, stat.st_mtime, __version__)).fetchone()
+    if row and row[0]:
+        return unpack_signature(row[0])
+    return describe_draft(read_weavemaker(path), os.path.basename(path))[2]
+
+def report_drafts(rows):
+    """ One line per draft """
+    msg = [f"{len(rows)} drafts:"]
+    for r in rows:
+        mode = "liftplan" if r["liftplan"] else f"{r['treadles']} treadles"
+        msg.append(f" - {r['path']}: {r['shafts']} shafts, {mode}, {r['warps']}x{r['wefts']},"
+                   f" {r['colorways']} colorways, {r['colors_used']} colors  {r['name'] or ''}")
+    return msg
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Catalog a library of WeaveMaker files in SQLite, and search it.")
+    parser.add_argument("--db", default="catalog.sqlite", help="catalog database (default catalog.sqlite)")
+    commands = parser.add_subparsers(dest="command", required=True)
+    scan = commands.add_parser("scan", help="add new and changed files below a directory")
+    scan.add_argument("library", help="wmd/wmdf file or directory to catalog")
+    scan.add_argument("-v", "--verbose", action="store_true", help="list every file catalogued")
+    query = commands.add_parser("query", help="list catalogued drafts matching every filter")
+    query.add_argument("--shafts", type=int)
+    query.add_argument("--liftplan", action="store_true", default=None, help="only drafts with a liftplan")
+    query.add_argument("--tieup", dest="liftplan", action="store_false", help="only drafts with a tieup")
+    query.add_argument("--min-colorways", type=int)
+    query.add_argument("--segment", help="only drafts holding this segment id")
+    query.add_argument("--where", help="extra SQL condition, e.g. \"warps > 1000 AND version LIKE '8%%'\"")
+    similar = commands.add_parser("similar", help="list catalogued drafts most like a file")
+    similar.add_argument("file", help="wmd/wmdf file, catalogued or not")
+    similar.add_argument("--limit", type=int, default=10)
+    similar.add_argument("--min", type=float, default=0.0, help="lowest similarity to list (0-1)")
+    args = parser.parse_args(argv)
+    conn = open_catalog(args.db)
+    try:
+        if args.command == "scan":
+            counts = scan_library(conn, args.library, args.verbose)
+            print("\n".join(report_scan(counts)))
+            return 1 if counts["failed"] else 0
+        if args.command == "similar":
+            signature = signature_for(conn, args.file)
+            if signature is None:
+                print("Nothing in that file to compare.")
+                return 1
+            found = similar_drafts(conn, signature, args.limit, args.min)
+            print(f"{len(found)} similar drafts:")
+            print("\n".join([f" - {score:.2f}  {path}" for score, path in found]))
+            return 0
+        rows = query_drafts(conn, args.shafts, args.liftplan, args.min_colorways, args.segment, args.where)
+        print("\n".join(report_drafts(rows)))
+        return 0
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,204 @@
+#conversion
+
+# Converting several files at once, independent of the browser.
+#  - files are read concurrently (each source supplies a coroutine returning its bytes),
+#  - each file is parsed as it arrives (chunk by chunk if it is streamed), handing control back to the event loop
+#    between files so a page stays responsive,
+#  - every file x colorway can be packed into a single zip.
+# main.py drives this from the web page, it runs the same on plain CPython.
+# Also runs under MicroPython (no zipfile there, so zips are written by hand).
+#
+# Usage:
+#   python conversion.py out.zip file.wmdf [file.wmdf ...]
+
+import io
+import os
+import sys
+import asyncio
+from struct import pack
+try:
+    import zipfile
+except ImportError:  # MicroPython
+    zipfile = None
+
+from weavemaker import parse_wmdf, WMDF, WMDFParser, report_diagnostics
+
+
+class Conversion(object):
+    """
+    Outcome of converting one file.
+    - draft is the WMDF, or None if it failed (then error says why)
+    """
+    def __init__(self, filename, draft=None, error=None, size=0):
+        self.filename = filename
+        self.draft = draft
+        self.error = error
+        self.size = size
+
+    def __repr__(self):
+        outcome = f"{len(self.draft.c_mapping)} colorways" if self.draft else f"failed: {self.error}"
+        return f"<Conversion: {self.filename} {outcome}>"
+
+
+def make_draft(data, colors, filename, diagnostics):
+    """ WMDF, warning about any damage found while parsing """
+    draft = WMDF(data, colors, filename)
+    if diagnostics:
+        draft.warnings.append("Parts of the file could not be read:")
+        draft.warnings.extend(report_diagnostics(diagnostics))
+    return draft
+
+def convert_bytes(contents, filename):
+    """ Parse one file's contents into a Conversion, never raises """
+    try:
+        diagnostics = []
+        data, colors = parse_wmdf(contents, diagnostics=diagnostics)
+        return Conversion(filename, make_draft(data, colors, filename, diagnostics), size=len(contents))
+    except Exception as e:
+        return Conversion(filename, error=f"{type(e).__name__}: {e}", size=len(contents))
+
+async def convert_chunks(chunks, filename):
+    """ Parse a file as its chunks arrive (async iterator) into a Conversion, never raises """
+    parser = WMDFParser(diagnostics=[])
+    try:
+        async for chunk in chunks:
+            parser.feed(chunk)  # a bad header stops here, before the rest is read
+        data, colors = parser.close()
+        return Conversion(filename, make_draft(data, colors, filename, parser.diagnostics), size=parser.size)
+    except Exception as e:
+        return Conversion(filename, error=f"{type(e).__name__}: {e}", size=parser.size)
+
+async def read_and_convert(filename, read, on_converted=None):
+    """
+    Read one file then convert it straight away.
+    - read() gives the file's bytes (a coroutine), or an async iterator of chunks
+      which are parsed as they arrive
+    - the other files carry on reading while this one converts
+    """
+    try:
+        source = read()
+        if hasattr(source, "__aiter__"):
+            conversion = await convert_chunks(source, filename)
+        else:
+            conversion = convert_bytes(await source, filename)
+    except Exception as e:
+        conversion = Conversion(filename, error=f"{type(e).__name__}: {e}")
+    if on_converted:
+        on_converted(conversion)
+    await asyncio.sleep(0)  # let the page (or other tasks) run between files
+    return conversion
+
+async def convert_files(sources, on_converted=None):
+    """
+    Convert many files, reading them all at once.
+    - sources: [filename, read] pairs, read() as for read_and_convert
+    - on_converted(conversion) is called as each file finishes (e.g. to update a page)
+    - returns the Conversions in the order of sources
+    """
+    tasks = [read_and_convert(filename, read, on_converted) for filename, read in sources]
+    return list(await asyncio.gather(*tasks))
+
+def unique_name(name, used):
+    """ name, or name with a number added if already used """
+    if name not in used:
+        used.add(name)
+        return name
+    stem, dot, extension = name.rpartition(".")
+    count = 2
+    while f"{stem}({count}){dot}{extension}" in used:
+        count += 1
+    name = f"{stem}({count}){dot}{extension}"
+    used.add(name)
+    return name
+
+def zip_wifs(conversions):
+    """
+    Bytes of a zip holding the wif of every colorway of every converted file.
+    - failed conversions are skipped
+    """
+    used = set()
+    members = []
+    for conversion in conversions:
+        if conversion.draft:
+            for wif_filename, wif in conversion.draft.make_wifs():
+                members.append([unique_name(wif_filename, used), wif.encode('utf-8')])
+    if zipfile is None:
+        return stored_zip(members)
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as z:
+        for name, contents in members:
+            z.writestr(name, contents)
+    return buffer.getvalue()
+
+crc_table = []  # filled in on first use
+
+def crc32(data, crc=0):
+    """ zip checksum, for when there is no zlib or binascii to do it """
+    if not crc_table:
+        for n in range(256):
+            c = n
+            for k in range(8):
+                c = (0xEDB88320 ^ (c >> 1)) if c & 1 else (c >> 1)
+            crc_table.append(c)
+    crc ^= 0xFFFFFFFF
+    for b in data:
+        crc = crc_table[(crc ^ b) & 0xFF] ^ (crc >> 8)
+    return crc ^ 0xFFFFFFFF
+
+def stored_zip(members):
+    """
+    Bytes of an uncompressed zip of [name, bytes] members.
+    - only needed where there is no zipfile module (MicroPython)
+    """
+    try:
+        from binascii import crc32 as checksum
+    except ImportError:
+        checksum = crc32
+    output = bytearray()
+    directory = bytearray()
+    for name, contents in members:
+        name = name.encode('utf-8')
+        crc = checksum(contents) & 0xFFFFFFFF
+        size = len(contents)
+        # version 2.0, utf-8 names, stored, no date
+        fields = pack('<HHHHHIII', 20, 0x800, 0, 0, 0x21, crc, size, size)
+        directory += pack('<IH', 0x02014b50, 20) + fields + pack('<HHHHHII', len(name), 0, 0, 0, 0, 0, len(output)) + name
+        output += pack('<I', 0x04034b50) + fields + pack('<HH', len(name), 0) + name + contents
+    end = pack('<IHHHHIIH', 0x06054b50, 0, 0, len(members), len(members), len(directory), len(output), 0)
+    return bytes(output + directory + end)
+
+def report_conversions(conversions):
+    """ One line per file """
+    msg = []
+    converted = [c for c in conversions if c.draft]
+    msg.append(f"Converted {len(converted)} of {len(conversions)} files.")
+    for c in conversions:
+        if c.draft:
+            msg.append(f" - {c.filename}: {len(c.draft.c_mapping)} colorways")
+        else:
+            msg.append(f" - {c.filename}: FAILED ({c.error})")
+    return msg
+
+
+def file_reader(filename):
+    """ Coroutine function reading a local file, for convert_files """
+    async def read():
+        with open(filename, 'rb') as f:
+            return f.read()
+    return read
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if len(argv) < 2:
+        print("Usage: python conversion.py out.zip file.wmdf [file.wmdf ...]")
+        return 2
+    output, filenames = argv[0], argv[1:]
+    conversions = asyncio.run(convert_files([[os.path.basename(f), file_reader(f)] for f in filenames]))
+    with open(output, 'wb') as f:
+        f.write(zip_wifs(conversions))
+    print("\n".join(report_conversions(conversions)))
+    return 0 if all([c.draft for c in conversions]) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,208 @@
+#drawdown
+
+# The cloth a draft weaves (its drawdown), as an image.
+# A warp end shows on a pick when its shaft is raised, otherwise the weft shows.
+# Worked out a whole row at a time with int bitmasks, not cell by cell:
+#  - each shaft has a mask of the ends threaded on it,
+#  - a pick's raised ends are the OR of the masks of the shafts it lifts,
+#  - the row's pixels are picked from the warp colors or the pick's weft color
+#    by and-ing the mask into the rows of rgb bytes (as big ints).
+# Picks lifting the same shafts in the same weft color give the same row, so each
+# distinct row is only worked out once, whatever the draft's size.
+# Large drafts are sampled down (max_size) to make thumbnails, small ones can be zoomed.
+# Writes PNG or PPM, standard library only.
+#
+# Usage:
+#   python drawdown.py file.wmdf out.png [--colorway 1] [--max-size 1024] [--zoom 1]
+#   python drawdown.py library_dir thumbnails_dir   (a png for every file)
+
+import os
+import sys
+import zlib
+import struct
+import argparse
+
+from weavemaker import read_weavemaker, parse_wmdf, WMDF
+
+missing_color = [128, 128, 128]  # for threads whose color is not in the colorway
+raised_bits = {ord('1'): '\xff\xff\xff', ord('0'): '\x00\x00\x00'}  # bit to 3 byte mask
+
+
+class Drawdown(object):
+    """
+    Rows of rgb pixels of the cloth woven by a (loaded) WMDF in one colorway.
+    - rows(ends, picks): bytes for each pick in picks, one pixel for each end in ends
+    - sample(): the ends and picks for an image of at most max_size pixels
+    """
+    def __init__(self, draft, colorway=0):
+        self.draft = draft
+        self.colorway = colorway
+        threading = draft.threading
+        self.end_shafts = [threading.first(i) for i in range(len(threading))]  # -1 if unthreaded
+        self.pick_lifts = draft.lifts()
+        warp_map, weft_map = draft.c_mapping[colorway] if draft.c_mapping else [[], []]
+        self.end_colors = self.thread_colors(draft.warp_colors, warp_map, len(self.end_shafts))
+        self.pick_colors = self.thread_colors(draft.weft_colors, weft_map, len(self.pick_lifts))
+        self.row_cache = {}  # (ends key, lifts, weft color): row bytes
+        self.shaft_masks = {}  # ends key: {shaft: mask of the columns threaded on it}
+        self.warp_rows = {}  # ends key: warp colors of the columns as an int
+
+    def __repr__(self):
+        return f"<Drawdown: {len(self.end_shafts)} ends x {len(self.pick_lifts)} picks, colorway {self.colorway+1}>"
+
+    @property
+    def ends(self):
+        return len(self.end_shafts)
+
+    @property
+    def picks(self):
+        return len(self.pick_lifts)
+
+    def thread_colors(self, color_indices, mapping, count):
+        """ [r,g,b] of each thread in this colorway """
+        palette = dict([[index, color[0]] for index, color in mapping])
+        colors = self.draft.colors
+        result = []
+        for i in range(count):
+            index = color_indices[i] if color_indices and i < len(color_indices) else None
+            if index in palette:
+                result.append(palette[index])
+            elif index is not None and 0 <= index < len(colors):
+                result.append(colors[index][0])
+            else:
+                result.append(missing_color)
+        return result
+
+    def forget(self):
+        """ Drop the cached rows and columns """
+        self.row_cache.clear()
+        self.shaft_masks.clear()
+        self.warp_rows.clear()
+
+    def sample(self, max_size=None, zoom=1):
+        """
+        [ends, picks] index lists for the whole cloth.
+        - every step'th thread if needed to fit in max_size pixels, each thread zoom pixels wide
+        """
+        step = 1
+        if max_size:
+            longest = max(self.ends, self.picks, 1) * zoom
+            step = -(-longest // max_size)
+        ends = [j for j in range(0, self.ends, step) for z in range(zoom)]
+        picks = [p for p in range(0, self.picks, step) for z in range(zoom)]
+        return ends, picks
+
+    def columns(self, ends):
+        """ Shaft masks and warp color int for a list of ends, worked out once per list """
+        key = tuple(ends)
+        if key not in self.shaft_masks:
+            shafts = bytes([self.end_shafts[j] + 1 for j in ends])  # 0 = unthreaded
+            masks = {}
+            for s in set(shafts):
+                if s:
+                    # '1' where the column is on shaft s, column 0 is bit 0
+                    table = bytes([49 if b == s else 48 for b in range(256)])
+                    masks[s - 1] = int(shafts.translate(table)[::-1], 2)
+            self.shaft_masks[key] = masks
+            self.warp_rows[key] = int.from_bytes(bytes([v for j in ends for v in self.end_colors[j]]), 'big')
+        return key, self.shaft_masks[key], self.warp_rows[key]
+
+    def rows(self, ends, picks):
+        """ Yield the rgb bytes of each pick in picks, a pixel per end in ends """
+        key, masks, warp_row = self.columns(ends)
+        width = len(ends)
+        raised_cache = {}  # lifts: raised columns mask
+        for p in picks:
+            lifts = self.pick_lifts[p]
+            weft = tuple(self.pick_colors[p])
+            cache_key = (key, lifts, weft)
+            row = self.row_cache.get(cache_key)
+            if row is None:
+                raised = raised_cache.get(lifts)
+                if raised is None:
+                    raised = 0
+                    for s, mask in masks.items():
+                        if (lifts >> s) & 1:
+                            raised |= mask
+                    raised_cache[lifts] = raised
+                bits = bin(raised)[2:].zfill(width)[::-1] if width else ""
+                select = int.from_bytes(bits.translate(raised_bits).encode('latin-1'), 'big')
+                weft_row = int.from_bytes(bytes(weft) * width, 'big')
+                row = ((warp_row & select) | (weft_row & ~select)).to_bytes(3 * width, 'big')
+                self.row_cache[cache_key] = row
+            yield row
+
+    def write_ppm(self, fileobj, ends, picks):
+        """ Binary PPM (P6) of the ends x picks region """
+        fileobj.write(f"P6\n{len(ends)} {len(picks)}\n255\n".encode('ascii'))
+        for row in self.rows(ends, picks):
+            fileobj.write(row)
+
+    def write_png(self, fileobj, ends, picks):
+        """ 8 bit rgb PNG of the ends x picks region, compressed as it goes """
+        def chunk(kind, data):
+            fileobj.write(struct.pack('>I', len(data)) + kind + data)
+            fileobj.write(struct.pack('>I', zlib.crc32(kind + data) & 0xFFFFFFFF))
+        fileobj.write(b'\x89PNG\r\n\x1a\n')
+        chunk(b'IHDR', struct.pack('>IIBBBBB', len(ends), len(picks), 8, 2, 0, 0, 0))
+        compressor = zlib.compressobj(6)
+        pending = []
+        size = 0
+        for row in self.rows(ends, picks):
+            pending.append(b'\x00')  # no filter
+            pending.append(row)
+            size += len(row) + 1
+            if size > 1 << 20:
+                data = compressor.compress(b"".join(pending))
+                if data:
+                    chunk(b'IDAT', data)
+                pending, size = [], 0
+        chunk(b'IDAT', compressor.compress(b"".join(pending)) + compressor.flush())
+        chunk(b'IEND', b"")
+
+    def save(self, filename, max_size=None, zoom=1):
+        """ Write the whole cloth as .png or .ppm (by filename) """
+        ends, picks = self.sample(max_size, zoom)
+        with open(filename, 'wb') as f:
+            if filename.lower().endswith(".ppm"):
+                self.write_ppm(f, ends, picks)
+            else:
+                self.write_png(f, ends, picks)
+        return len(ends), len(picks)
+
+
+def save_drawdown(src, dst, colorway=0, max_size=1024, zoom=1):
+    """ Image of the cloth of the wmd/wmdf file src, returns its size """
+    data, colors = parse_wmdf(read_weavemaker(src))
+    draft = WMDF(data, colors, os.path.basename(src), lazy=True)
+    return Drawdown(draft, colorway).save(dst, max_size, zoom)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Draw the cloth woven by WeaveMaker files as png/ppm images.")
+    parser.add_argument("input", help="wmd/wmdf file, or directory of them")
+    parser.add_argument("output", help="image file (.png or .ppm), or directory for a png per file")
+    parser.add_argument("--colorway", type=int, default=1, help="colorway to use (from 1)")
+    parser.add_argument("--max-size", type=int, default=1024, help="largest side in pixels, 0 for full size")
+    parser.add_argument("--zoom", type=int, default=1, help="pixels per thread")
+    args = parser.parse_args(argv)
+    if not os.path.isdir(args.input):
+        width, height = save_drawdown(args.input, args.output, args.colorway - 1, args.max_size, args.zoom)
+        print(f"{args.output}: {width}x{height}")
+        return 0
+    from batch import find_weavemaker_files
+    failed = 0
+    for src in find_weavemaker_files(args.input):
+        relative = os.path.relpath(src, args.input)
+        dst = os.path.join(args.output, os.path.splitext(relative)[0] + ".png")
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        try:
+            width, height = save_drawdown(src, dst, args.colorway - 1, args.max_size, args.zoom)
+            print(f"{dst}: {width}x{height}")
+        except Exception as e:
+            failed += 1
+            print(f"!!FAIL: {src}: {type(e).__name__}: {e}", file=sys.stderr)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
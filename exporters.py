@@ -0,0 +1,252 @@
+#exporters
+
+# Several output formats from one parsed draft.
+#  - wif:  the wif of each colorway, the same as make_wifs writes
+#  - json: one document holding the whole draft and every colorway's palette
+#  - wmdb: compact binary, the bit rows packed as they are plus the color tables,
+#          read back by read_compact without any text parsing
+# ExportSource works out what the formats share (wif sections, palettes, weave rows) once,
+# so exporting several formats parses the file and renders each section only once.
+# A new format is a function(source, colorways) -> [[filename, bytes], ...] decorated
+# with @exporter(name, extension).
+#
+# Usage:
+#   python exporters.py file.wmdf out_dir [--format wif] [--format json] [--format wmdb] [--colorway 1]
+
+import os
+import sys
+import json
+import argparse
+from array import array
+from struct import pack, unpack_from, calcsize
+
+from weavemaker import read_weavemaker, parse_wmdf, WMDF, BitRows, iter_wif_palette
+
+exporters = {}  # format name: [extension, function]
+
+def exporter(name, extension):
+    """ Register function as the exporter for the format name """
+    def register(function):
+        exporters[name] = [extension, function]
+        return function
+    return register
+
+
+class ExportSource(object):
+    """
+    What the exporters share, each part worked out on first use:
+    - wif_draft(), wif_weaving(), wif_palette(colorway): wif sections as text
+    - palette(colorway): [[index, [r,g,b]], ...] as the wif color table has it
+    - weave(): {'threading': BitRows, 'tieup' + 'treadling' or 'liftplan': BitRows}
+    """
+    def __init__(self, draft):
+        self.draft = draft
+        self.parts = {}
+
+    def __repr__(self):
+        return f"<ExportSource: {self.draft.filename} ({', '.join(self.parts)})>"
+
+    def part(self, key, make):
+        if key not in self.parts:
+            self.parts[key] = make()
+        return self.parts[key]
+
+    def base_name(self, extension):
+        filename = self.draft.filename
+        dotpos = filename.rfind(".")
+        return (filename[:dotpos] if dotpos > -1 else filename) + extension
+
+    def wif_draft(self):
+        return self.part("wif draft", lambda: "".join(self.draft.iter_wif_draft()))
+
+    def wif_weaving(self):
+        return self.part("wif weaving", lambda: "".join(self.draft.iter_wif_weaving()))
+
+    def palette(self, colorway):
+        return self.part(("palette", colorway), lambda: self.draft.build_wif_palette(colorway))
+
+    def wif_palette(self, colorway):
+        return self.part(("wif palette", colorway), lambda: "".join(self.draft.timed("wif palette", iter_wif_palette(self.palette(colorway)))))
+
+    def weave(self):
+        def make():
+            draft = self.draft
+            weave = {"threading": draft.threading}
+            treadled = draft.liftplan_as_treadles()
+            if draft.liftplan and not treadled:
+                weave["liftplan"] = draft.pegplan
+            else:
+                weave["tieup"], weave["treadling"] = treadled or [getattr(draft, "tieup", None), getattr(draft, "treadling", None)]
+            return weave
+        return self.part("weave", make)
+
+
+def export(draft, formats=None, colorways=None):
+    """
+    {format: [[filename, bytes], ...]} for each format (default: all of them)
+    - colorways (0 based, default all) limits the colorways written
+    """
+    if colorways is None:
+        colorways = range(len(draft.c_mapping))
+    source = ExportSource(draft)
+    result = {}
+    for name in formats or exporters:
+        if name not in exporters:
+            raise ValueError(f"Unknown format '{name}', known: {', '.join(exporters)}")
+        result[name] = exporters[name][1](source, list(colorways))
+    return result
+
+
+@exporter("wif", ".wif")
+def export_wif(source, colorways):
+    draft = source.draft
+    return [[draft.calc_wif_filename(draft.filename, colorway),
+             (source.wif_draft() + source.wif_palette(colorway) + source.wif_weaving()).encode('utf-8')]
+            for colorway in colorways]
+
+
+def actives_lists(bitrows):
+    """ 1 based actives of every row """
+    return [[a+1 for a in bitrows.actives(i)] for i in range(len(bitrows))]
+
+@exporter("json", ".json")
+def export_json(source, colorways):
+    draft = source.draft
+    weave = source.weave()
+    threading = weave["threading"]
+    document = {"format": "weavemaker-draft", "format_version": 1,
+                "source": draft.filename, "name": draft.name, "weavemaker_version": draft.version,
+                "comments": draft.comments, "remarks": draft.remarks,
+                "shafts": draft.shaft_count, "ends": len(threading), "picks": draft.weft_count,
+                "threading": [threading.first(i) + 1 for i in range(len(threading))]}  # 0 = unthreaded
+    if "liftplan" in weave:
+        document["liftplan"] = actives_lists(weave["liftplan"])
+    else:
+        tieup, treadling = weave["tieup"], weave["treadling"]
+        document["tieup"] = actives_lists(tieup.transpose()) if tieup else []  # shafts of each treadle
+        document["treadling"] = actives_lists(treadling) if treadling else []
+    document["warp_colors"] = list(draft.warp_colors or [])
+    document["weft_colors"] = list(draft.weft_colors or [])
+    document["colorways"] = [{"colorway": colorway + 1, "palette": source.palette(colorway)} for colorway in colorways]
+    document["notes"] = draft.conversion_notes + draft.warnings
+    return [[source.base_name(".json"), json.dumps(document, separators=(",", ":")).encode('utf-8')]]
+
+
+# wmdb: header, then sections of id byte, BE 32bit length, contents
+compact_magic = b"WMDB"
+compact_version = 1
+compact_header = '>4sBBHII'  # magic, version, flags (1 = liftplan), shafts, ends, picks
+row_codes = {1: 'B', 2: 'H', 4: 'I', 8: 'Q'}  # row sizes array can read in one go
+
+def pack_rows(id, bitrows):
+    """ Section of BE 16bit width, row byte size, rows as little endian ints """
+    size = max(1, (bitrows.width + 7) // 8)
+    if size <= 8:  # a size array reads directly
+        size = min([s for s in row_codes if s >= size])
+    rows = b"".join([row.to_bytes(size, 'little') for row in bitrows])
+    return pack('>cIHB', id, 3 + len(rows), bitrows.width, size) + rows
+
+def pack_text(id, text):
+    contents = (text or "").encode('utf-8')
+    return pack('>cI', id, len(contents)) + contents
+
+def pack_indices(id, values):
+    contents = pack(f'>{len(values)}h', *values)
+    return pack('>cI', id, len(contents)) + contents
+
+@exporter("wmdb", ".wmdb")
+def export_compact(source, colorways):
+    draft = source.draft
+    weave = source.weave()
+    flags = 1 if "liftplan" in weave else 0
+    parts = [pack(compact_header, compact_magic, compact_version, flags,
+                  draft.shaft_count, len(weave["threading"]), draft.weft_count or 0)]
+    for id, key in [[b't', "threading"], [b'u', "tieup"], [b'r', "treadling"], [b'p', "liftplan"]]:
+        if weave.get(key) is not None:
+            parts.append(pack_rows(id, weave[key]))
+    parts.append(pack_indices(b's', list(draft.warp_colors or [])))
+    parts.append(pack_indices(b'q', list(draft.weft_colors or [])))
+    palettes = [pack('>B', len(colorways))]
+    for colorway in colorways:
+        palette = source.palette(colorway)
+        palettes.append(pack('>H', len(palette)))
+        palettes.extend([pack('>H3B', index, *rgb) for index, rgb in palette])
+    palettes = b"".join(palettes)
+    parts.append(pack('>cI', b'C', len(palettes)) + palettes)
+    parts.append(pack_text(b'n', draft.name))
+    parts.append(pack_text(b'D', draft.version))
+    return [[source.base_name(".wmdb"), b"".join(parts)]]
+
+def read_compact(contents):
+    """
+    dict of a wmdb file: shafts, ends, picks, is_liftplan (flag), name, version,
+    threading/tieup/treadling/liftplan BitRows, warp_colors, weft_colors,
+    palettes: [[[index, [r,g,b]], ...] for each colorway]
+    """
+    view = memoryview(contents)
+    magic, version, flags, shafts, ends, picks = unpack_from(compact_header, view, 0)
+    if magic != compact_magic or version != compact_version:
+        raise ValueError(f"Not a version {compact_version} wmdb file")
+    draft = {"shafts": shafts, "ends": ends, "picks": picks, "is_liftplan": bool(flags & 1)}
+    names = {b't': "threading", b'u': "tieup", b'r': "treadling", b'p': "liftplan",
+             b's': "warp_colors", b'q': "weft_colors", b'n': "name", b'D': "version"}
+    i = calcsize(compact_header)
+    while i < len(view):
+        id, length = unpack_from('>cI', view, i)
+        i += 5
+        chunk = view[i:i+length]
+        i += length
+        if id in b'turp':
+            width, size = unpack_from('>HB', chunk, 0)
+            rows = bytes(chunk[3:])
+            code = row_codes.get(size)
+            if code and array(code).itemsize == size:
+                values = array(code, rows)
+                if sys.byteorder == 'big':
+                    values.byteswap()
+                values = values.tolist()
+            else:
+                values = [int.from_bytes(rows[j:j+size], 'little') for j in range(0, len(rows), size)]
+            draft[names[id]] = BitRows(width, values)
+        elif id in b'sq':
+            draft[names[id]] = list(unpack_from(f'>{length // 2}h', chunk, 0))
+        elif id in b'nD':
+            draft[names[id]] = str(chunk, 'utf-8')
+        elif id == b'C':
+            palettes = []
+            j = 1
+            for c in range(chunk[0]):
+                count = unpack_from('>H', chunk, j)[0]
+                j += 2
+                palette = []
+                for k in range(count):
+                    index, r, g, b = unpack_from('>H3B', chunk, j)
+                    palette.append([index, [r, g, b]])
+                    j += 5
+                palettes.append(palette)
+            draft["palettes"] = palettes
+    return draft
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export a WeaveMaker file as wif, json and/or compact binary.")
+    parser.add_argument("input", help="wmd/wmdf file")
+    parser.add_argument("output", help="directory to write the exports into")
+    parser.add_argument("--format", action="append", choices=sorted(exporters), help="format to write (repeatable, default all)")
+    parser.add_argument("--colorway", type=int, action="append", help="colorway to write, from 1 (repeatable, default all)")
+    parser.add_argument("--treadles", type=int, default=None, help="write a liftplan as at most this many treadles")
+    args = parser.parse_args(argv)
+    data, colors = parse_wmdf(read_weavemaker(args.input))
+    draft = WMDF(data, colors, os.path.basename(args.input), treadle_limit=args.treadles)
+    colorways = [c - 1 for c in args.colorway] if args.colorway else None
+    os.makedirs(args.output, exist_ok=True)
+    for name, files in export(draft, args.format, colorways).items():
+        for filename, contents in files:
+            with open(os.path.join(args.output, filename), 'wb') as f:
+                f.write(contents)
+            print(f"{name}: {filename} ({len(contents)} bytes)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
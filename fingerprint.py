@@ -0,0 +1,108 @@
+#fingerprint
+
+# Structural fingerprints of drafts, for finding near duplicates.
+# A draft is reduced to a set of short overlapping runs (shingles) of:
+#  - its threading, with shafts renumbered in order of first use (so a permuted
+#    threading/tieup gives the same shingles),
+#  - the shafts lifted on each pick, from tieup + treadling or from the liftplan,
+#    renumbered the same way (treadle order does not matter at all),
+#  - its warp and weft color sequences, with colors renumbered in order of first use
+#    (so a recolored colorway still matches), plus the actual colors, coarsely.
+# A MinHash signature of that set estimates how alike two drafts are (Jaccard), and
+# its bands are LSH keys: drafts sharing any band are the candidates worth comparing.
+# catalog.py stores signatures and bands for every draft it catalogs.
+
+import random
+import hashlib
+from array import array
+
+signature_size = 64
+band_rows = 4  # signature_size // band_rows bands, ~0.5 similarity is the LSH threshold
+shingle_sizes = {"threading": 4, "lifts": 3, "colors": 4}
+prime = (1 << 61) - 1
+seeded = random.Random(20)  # fixed, so signatures stay comparable between runs
+permutations = [[seeded.randrange(1, prime), seeded.randrange(prime)] for i in range(signature_size)]
+
+
+def first_use_numbering(sequence, numbering=None):
+    """ {value: n} numbering values in the order they first appear """
+    numbering = {} if numbering is None else numbering
+    for value in sequence:
+        if value not in numbering:
+            numbering[value] = len(numbering)
+    return numbering
+
+def renumber_mask(mask, numbering):
+    """ mask with bit i moved to bit numbering[i] """
+    renumbered = 0
+    i = 0
+    while mask:
+        if mask & 1:
+            renumbered |= 1 << numbering[i]
+        mask >>= 1
+        i += 1
+    return renumbered
+
+def shingles(kind, sequence, size):
+    """ Set of 'kind:a,b,c' strings for each run of size values """
+    sequence = [str(v) for v in sequence]
+    if len(sequence) <= size:
+        return set([f"{kind}:{','.join(sequence)}"]) if sequence else set()
+    return set([f"{kind}:{','.join(sequence[i:i+size])}" for i in range(len(sequence) - size + 1)])
+
+def draft_features(draft):
+    """ The set of shingles describing a (loaded) WMDF's structure and colors """
+    threading = draft.threading
+    shafts_used = [threading.first(i) for i in range(len(threading))]
+    numbering = first_use_numbering([s for s in shafts_used if s >= 0])
+    lifts = draft.lifts()
+    # shafts only lifted, never threaded, are numbered after the threaded ones
+    for mask in set(lifts):
+        first_use_numbering([i for i in range(mask.bit_length()) if (mask >> i) & 1], numbering)
+    renumbered = {}
+    for mask in lifts:
+        if mask not in renumbered:
+            renumbered[mask] = renumber_mask(mask, numbering)
+    features = shingles("t", [numbering.get(s, -1) for s in shafts_used], shingle_sizes["threading"])
+    features |= shingles("l", [renumbered[m] for m in lifts], shingle_sizes["lifts"])
+    for kind, colors in [["w", draft.warp_colors], ["f", draft.weft_colors]]:
+        if colors:
+            color_numbering = first_use_numbering(colors)
+            features |= shingles(kind, [color_numbering[c] for c in colors], shingle_sizes["colors"])
+    if draft.c_mapping:  # the first colorway's actual colors, 3 bits a channel
+        for group in draft.c_mapping[0]:
+            features |= set([f"rgb:{[v >> 5 for v in color[0]]}" for index, color in group])
+    return features
+
+def feature_hash(feature):
+    return int.from_bytes(hashlib.blake2b(feature.encode('utf-8'), digest_size=8).digest(), 'little')
+
+def minhash(features):
+    """ MinHash signature (signature_size ints) of a set of strings, None for an empty set """
+    if not features:
+        return None
+    hashes = [feature_hash(f) for f in features]
+    return [min([(a * h + b) % prime for h in hashes]) for a, b in permutations]
+
+def draft_signature(draft):
+    return minhash(draft_features(draft))
+
+def similarity(signature_a, signature_b):
+    """ Estimated Jaccard similarity of the feature sets behind two signatures """
+    same = sum([1 for a, b in zip(signature_a, signature_b) if a == b])
+    return same / len(signature_a)
+
+def band_keys(signature):
+    """ [band, bucket] LSH keys, drafts sharing any one are candidates """
+    keys = []
+    for band, start in enumerate(range(0, len(signature), band_rows)):
+        packed = array('Q', signature[start:start+band_rows]).tobytes()
+        bucket = int.from_bytes(hashlib.blake2b(packed, digest_size=8).digest(), 'little', signed=True)
+        keys.append([band, bucket])
+    return keys
+
+def pack_signature(signature):
+    return array('Q', signature).tobytes()
+
+def unpack_signature(blob):
+    return list(array('Q', blob))
@@ -0,0 +1,137 @@
+#golden
+
+# Regression check of the converter against a committed corpus.
+# corpus/corpus.json lists the cases: the wmdf_synth options each corpus/<case>.wmdf was
+# made with, and its budgets. For every case:
+#  - every colorway's wif must match corpus/golden/<wif name> byte for byte, and
+#    the reports (summary, file structure, notes, warnings, damage skipped) must
+#    match corpus/golden/<case>.txt,
+#  - converting it (parse_wmdf, WMDF, make_wifs) must take at most "seconds" (best of
+#    --repeats runs) and allocate at most "peak_kb" kB of python memory at its peak.
+# Exits 1 on any difference or budget overrun, so hot paths can be reworked safely.
+#
+# Usage:
+#   python golden.py [--repeats 3] [--slack 1.0] [case ...]
+#   python golden.py --update [case ...]    rewrite the golden files after an intended change
+#   python golden.py --generate [case ...]  rewrite the corpus files from their options
+
+import os
+import sys
+import json
+import difflib
+import argparse
+
+from weavemaker import parse_wmdf, WMDF, report_diagnostics
+from wmdf_synth import make_wmdf
+from bench import time_stage, peak_memory
+
+corpus_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "corpus")
+golden_dir = os.path.join(corpus_dir, "golden")
+
+
+def load_manifest():
+    with open(os.path.join(corpus_dir, "corpus.json")) as f:
+        return json.load(f)
+
+def convert(contents, filename):
+    """ [[wif_filename, wif], ...] for every colorway, and the report text """
+    diagnostics = []
+    data, colors = parse_wmdf(contents, diagnostics=diagnostics)
+    w = WMDF(data, colors, filename)
+    wifs = w.make_wifs()
+    report = w.report_summary() + w.report_fstructure() + w.conversion_notes + w.warnings + report_diagnostics(diagnostics)
+    return wifs, "\n".join(report) + "\n"
+
+def outputs(case):
+    """ {golden file name: text} for a case """
+    filename = case["name"] + ".wmdf"
+    with open(os.path.join(corpus_dir, filename), 'rb') as f:
+        contents = f.read()
+    wifs, report = convert(contents, filename)
+    result = dict(wifs)
+    result[case["name"] + ".txt"] = report
+    return contents, result
+
+def difference(name, expected, got, lines=12):
+    """ The first lines of a unified diff """
+    diff = difflib.unified_diff(expected.splitlines(), got.splitlines(), "golden/" + name, "now", lineterm="")
+    return [f"   {line}" for line in list(diff)[:lines]]
+
+def check_case(case, repeats=3, slack=1.0):
+    """ Report lines of every difference and overrun, empty if the case passes """
+    contents, produced = outputs(case)
+    msg = []
+    for name, text in produced.items():
+        path = os.path.join(golden_dir, name)
+        if not os.path.exists(path):
+            msg.append(f" - {name}: no golden file (run --update)")
+            continue
+        with open(path, encoding='utf-8', newline='') as f:
+            expected = f.read()
+        if text != expected:
+            msg.append(f" - {name} differs:")
+            msg.extend(difference(name, expected, text))
+    filename = case["name"] + ".wmdf"
+    seconds = time_stage(lambda: convert(contents, filename), repeats)
+    peak_kb = peak_memory(lambda: convert(contents, filename)) / 1024
+    budget = case["budget"]
+    if seconds > budget["seconds"] * slack:
+        msg.append(f" - took {seconds*1000:.1f} ms, budget {budget['seconds']*1000*slack:.1f} ms")
+    if peak_kb > budget["peak_kb"] * slack:
+        msg.append(f" - peak {peak_kb:.0f} kB, budget {budget['peak_kb']*slack:.0f} kB")
+    return msg, seconds, peak_kb
+
+def update_case(case):
+    """ Write the case's golden files, returns their names """
+    os.makedirs(golden_dir, exist_ok=True)
+    contents, produced = outputs(case)
+    for name, text in produced.items():
+        with open(os.path.join(golden_dir, name), 'w', encoding='utf-8', newline='') as f:
+            f.write(text)
+    return list(produced)
+
+def generate_case(case):
+    """ Write the case's corpus file from its wmdf_synth options """
+    contents = make_wmdf(**case["options"])
+    with open(os.path.join(corpus_dir, case["name"] + ".wmdf"), 'wb') as f:
+        f.write(contents)
+    return len(contents)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check the converter's output and speed against the golden corpus.")
+    parser.add_argument("cases", nargs="*", help="cases to run (default: all)")
+    parser.add_argument("--update", action="store_true", help="rewrite the golden files instead of checking")
+    parser.add_argument("--generate", action="store_true", help="rewrite the corpus files from their options")
+    parser.add_argument("--repeats", type=int, default=3, help="timing runs per case, the best counts")
+    parser.add_argument("--slack", type=float, default=1.0, help="multiply every budget by this (slow machines)")
+    args = parser.parse_args(argv)
+    cases = load_manifest()["cases"]
+    if args.cases:
+        unknown = set(args.cases) - set([c["name"] for c in cases])
+        if unknown:
+            print(f"Unknown cases: {', '.join(sorted(unknown))}")
+            return 2
+        cases = [c for c in cases if c["name"] in args.cases]
+    if args.generate:
+        for case in cases:
+            print(f"{case['name']}.wmdf: {generate_case(case)} bytes")
+        return 0
+    if args.update:
+        for case in cases:
+            print(f"{case['name']}: {', '.join(update_case(case))}")
+        return 0
+    failed = 0
+    for case in cases:
+        msg, seconds, peak_kb = check_case(case, args.repeats, args.slack)
+        outcome = "FAIL" if msg else "ok"
+        print(f"{case['name']:<24} {outcome:<4} {seconds*1000:>8.1f} ms {peak_kb:>8.0f} kB peak")
+        if msg:
+            failed += 1
+            print("\n".join(msg))
+    print(f"{len(cases) - failed} of {len(cases)} cases passed.")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,35 +1,34 @@
 import ltk
 import asyncio  # for file uploading
-from weavemaker import *
+from conversion import convert_files, zip_wifs, report_conversions
 # File save support
 import io
 from js import Uint8Array, URL, File
 
 #ltk.window.document.currentScript.terminal.resize(60, 12)
 
-# Allow user to upload a wmd/wmdf file from WeaveMaker
+# Allow user to upload one or more wmd/wmdf files from WeaveMaker
 # - Show the colorwyas found and other info,
-# - quietly convert the file into a wif representation,
-# - allow user to download the wif as a file.
+# - quietly convert the files into a wif representation,
+# - allow user to download a wif as a file, or all of them as a zip.
 
 
 current_wmd = None  # Holds the current wmd file class object
+current_conversions = []  # All the files from the last upload
+upload_tasks = set()  # Running uploads: the event loop only keeps weak references to tasks
 
-###     
-def act_on_file(bytestream, widget, filename):
+###
+def show_wmd(wmd, widget, preamble=""):
     """
-    Load the wmd file and convert it.
+    Make wmd the current file.
     Update UI:
     - number of colorways,
     - Select widget (colorways),
-    - Report section,
+    - Report section (after preamble),
     - show colors if we can be bothered...
-    Set a global variable for others to reference wmdf.
     """
     global current_wmd
-    #print("Processing file")
-    data, colors = parse_wmdf(bytestream)
-    current_wmd = WMDF(data, colors, filename)
+    current_wmd = wmd
     num_colorways = len(current_wmd.c_mapping)
     #
     widget.colorway_count.text(num_colorways)
@@ -39,8 +38,8 @@ def act_on_file(bytestream, widget, filename):
     for val in range(num_colorways):
         chooser.append(f"<option>{str(val+1)}</option>").attr("value", str(val+1)).addClass("ltk-select vcenter")
     # Report
-        #report_text = "\n".join(current_wmd.report_fstructure())
-        report_text = "\n - ".join(current_wmd.report_summary())
+    #report_text = "\n".join(current_wmd.report_fstructure())
+    report_text = preamble + "\n - ".join(current_wmd.report_summary())
     if current_wmd.conversion_notes:
         report_text += "\n"+"\n - ".join(current_wmd.report_conversion_notes())
     if current_wmd.warnings:
@@ -48,53 +47,95 @@ def act_on_file(bytestream, widget, filename):
     widget.RHS_report.text(report_text)
 
 
-### Upload the file
+### Upload the files
 async def get_bytes_from_file(file):
     """ Asynchronously fetch the bytes inside the file """
     array_buf = await file.arrayBuffer()
-    return array_buf.to_bytes()
+    if hasattr(array_buf, "to_bytes"):  # pyodide
+        return array_buf.to_bytes()
+    return bytes(Uint8Array.new(array_buf))  # micropython
 
-async def get_file(first_item, widget):
+class FileChunks(object):
+    """ Async iterator over a file's bytes as the browser reads them, so parsing starts early """
+    def __init__(self, file):
+        self.reader = file.stream().getReader()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        result = await self.reader.read()
+        if result.done:
+            raise StopAsyncIteration
+        if hasattr(result.value, "to_bytes"):  # pyodide
+            return result.value.to_bytes()
+        return bytes(result.value)  # micropython
+
+def file_source(file):
+    """ [name, read] pair for convert_files """
+    if hasattr(file, "stream"):
+        return [file.name, lambda: FileChunks(file)]
+    return [file.name, lambda: get_bytes_from_file(file)]
+
+async def get_files(files, widget):
     """ 
-    Asynchronously fetch the file 
-    - returns a read-only array of bytes
+    Asynchronously fetch and convert all the files
+    - the first file converted becomes the current one
     """
-    #my_bytes: bytes = await get_bytes_from_file(first_item)
-    my_bytes = await get_bytes_from_file(first_item)
-    act_on_file(my_bytes, widget, first_item.name)
+    global current_conversions
+    sources = [file_source(files.item(i)) for i in range(files.length)]
+    widget.RHS_report.text(f"Converting {len(sources)} files...")
+    current_conversions = await convert_files(sources)
+    converted = [c for c in current_conversions if c.draft]
+    preamble = ""
+    if len(current_conversions) > 1:
+        preamble = "\n".join(report_conversions(current_conversions)) + "\n\n"
+    if converted:
+        show_wmd(converted[0].draft, widget, preamble)
+    else:
+        widget.RHS_report.text(preamble + "No files could be converted.")
 
 def upload_file(event, widget):
-    """ Event to upload a file and act on it """
-    file_list = event.target.files
-    first_item = file_list.item(0)
-    loop = asyncio.get_event_loop()
-    try:
-        loop.run_until_complete(get_file(first_item, widget))
-    finally:
-        loop.close()
+    """ Event to upload files and act on them (without blocking the page) """
+    # micropython's asyncio has no ensure_future
+    schedule = getattr(asyncio, "ensure_future", asyncio.create_task)
+    task = schedule(get_files(event.target.files, widget))
+    if hasattr(task, "add_done_callback"):  # micropython's loop holds on to its tasks itself
+        upload_tasks.add(task)
+        task.add_done_callback(upload_tasks.discard)
 
 ### Download the wif to user
+def send_to_user(buffer, filename, mime_type):
+    """ Hand the bytes in buffer to the user as a download called filename """
+    # Copy of the contents into the JavaScript buffer
+    js_array = Uint8Array.new(len(buffer))
+    if hasattr(js_array, "assign"):  # pyodide
+        js_array.assign(buffer)
+    else:  # micropython
+        js_array.set(buffer)
+    # File constructor takes a buffer, name, MIME type. (name not used)
+    # https://developer.mozilla.org/en-US/docs/Web/HTTP/Basics_of_HTTP/MIME_types
+    file = File.new([js_array], "foo.txt", {type: mime_type})
+    url = URL.createObjectURL(file)
+    hidden_link = ltk.window.document.createElement("a")
+    # The second parameter here is the actual name of the file that will appear in the user's file system
+    hidden_link.setAttribute("download", filename)
+    hidden_link.setAttribute("href", url)
+    hidden_link.click()
+
 def download_file(event, widget):
     # make the wif
     cway_chooser = ltk.find("#cway_chooser")
     selected_colorway = int(cway_chooser.val())-1
     if current_wmd:
-        current_wmd.make_wif(selected_colorway)
-        data = current_wmd.wif
-        encoded_data = data.encode('utf-8')  # Transform our string of data into bytes
-        my_stream = io.BytesIO(encoded_data)  # convert data into bytesIO object
-        # Copy of the contents into the JavaScript buffer
-        js_array = Uint8Array.new(len(encoded_data))
-        js_array.assign(my_stream.getbuffer())
-        # File constructor takes a buffer, name, MIME type. (name not used)
-        # https://developer.mozilla.org/en-US/docs/Web/HTTP/Basics_of_HTTP/MIME_types
-        file = File.new([js_array], "foo.txt", {type: "text/plain"})
-        url = URL.createObjectURL(file)
-        hidden_link = ltk.window.document.createElement("a")
-        # The second parameter here is the actual name of the file that will appear in the user's file system
-        hidden_link.setAttribute("download", current_wmd.wif_filename)
-        hidden_link.setAttribute("href", url)
-        hidden_link.click()
+        my_stream = io.BytesIO()
+        current_wmd.write_wif(my_stream, selected_colorway)  # wif written straight in as bytes
+        send_to_user(my_stream.getvalue(), current_wmd.wif_filename, "text/plain")
+
+def download_zip(event, widget):
+    """ Every colorway of every uploaded file, in one zip """
+    if any([c.draft for c in current_conversions]):
+        send_to_user(zip_wifs(current_conversions), "wifs.zip", "application/zip")
 
 
 class WMD_widget(object):
@@ -116,8 +157,9 @@ class WMD_widget(object):
         self.RHS_report = ltk.TextArea(self.report_text).addClass("report mytext")
         self.colorway_count = ltk.Text("0").addClass("cway_count vcenter cway_color  mytext")
         self.colorways = ["0"]  # Hold the possible colorways values
-        getfile_widget = ltk.File().attr("accept",".wmd, .wmdf").addClass("vcenter mytext").on("input", ltk.proxy(lambda event: upload_file(event, self)))
+        getfile_widget = ltk.File().attr("accept",".wmd, .wmdf").attr("multiple", "multiple").addClass("vcenter mytext").on("input", ltk.proxy(lambda event: upload_file(event, self)))
         download_widget = ltk.Button("Download wif file", ltk.proxy(lambda event: download_file(event, self))).addClass("vcenter mytext")
+        download_all_widget = ltk.Button("Download all as zip", ltk.proxy(lambda event: download_zip(event, self))).addClass("vcenter mytext")
         self.colorway_chooser = ltk.Select(self.colorways, 0, self.choose_colorway).addClass("vcenter  mytext cway_color").attr("id","cway_chooser")
         #
         LHS_controls = ltk.VBox(
@@ -129,7 +171,9 @@ class WMD_widget(object):
                                      ltk.Label("Choose a colorway:").addClass("label vcenter mytext"),
                                      self.colorway_chooser),
                             ltk.HBox(ltk.Label("3.").addClass("count mytext"),
-                                     download_widget)
+                                     download_widget),
+                            ltk.HBox(ltk.Label("or").addClass("count mytext"),
+                                     download_all_widget)
                         ).addClass("stepBox mytext")
         return (
             ltk.VBox(ltk.Text("WeaveMaker to WIF file converter").addClass("title mytext"),
@@ -0,0 +1,236 @@
+#server
+
+# Local http conversion service, standard library only.
+#  POST /convert?name=file.wmdf&colorway=1   body = wmd/wmdf file  -> wif text
+#  POST /batch?name=file.wmdf                body = wmd/wmdf file  -> zip of every colorway's wif
+#    either can add &treadles=N to write a liftplan as a tieup + treadling of at most N treadles
+#  GET  /health                                                    -> json counters
+# Conversions run in a process pool, started (and warmed up) before the first request.
+# Requests beyond the pool and a small bounded queue get a 503, so clients back off
+# instead of piling up work. Colorways in urls count from 1, as they do in the web page.
+#
+# Usage:
+#   python server.py [--port 8765] [-j workers] [--queue 16]
+
+import io
+import os
+import sys
+import json
+import asyncio
+import zipfile
+import argparse
+from urllib.parse import urlsplit, parse_qs, quote
+from concurrent.futures import ProcessPoolExecutor
+
+from weavemaker import parse_wmdf, WMDF
+
+max_upload = 16 * 1024 * 1024  # wmdf files are much smaller than this
+statuses = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+            413: "Payload Too Large", 422: "Unprocessable Entity", 500: "Internal Server Error",
+            503: "Service Unavailable"}
+
+
+### Run in the worker processes
+def warm_up():
+    """ Makes each worker import the converter before the first real request """
+    return True
+
+def convert_wif(contents, filename, colorway, treadle_limit=None):
+    """ [wif_filename, wif] for colorway (0 based) """
+    data, colors = parse_wmdf(contents)
+    w = WMDF(data, colors, filename, treadle_limit=treadle_limit)
+    if not 0 <= colorway < len(w.c_mapping):
+        raise IndexError(f"colorway {colorway+1} not in file ({len(w.c_mapping)} colorways)")
+    return w.make_wifs([colorway])[0]
+
+def convert_zip(contents, filename, treadle_limit=None):
+    """ Bytes of a zip holding the wif of every colorway """
+    data, colors = parse_wmdf(contents)
+    w = WMDF(data, colors, filename, treadle_limit=treadle_limit)
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as z:
+        for wif_filename, wif in w.make_wifs():
+            z.writestr(wif_filename, wif)
+    return buffer.getvalue()
+
+
+def safe_filename(name, default="upload.wmdf"):
+    """ The last part of a client's file name, without control characters, quotes or backslashes """
+    name = name.replace("\\", "/").rpartition("/")[2]
+    name = "".join([c for c in name if c.isprintable() and c not in '"\\']).strip()
+    return name if name.strip(".") else default
+
+def content_disposition(filename):
+    """ Content-Disposition of an attachment: an ascii filename, and the utf-8 one (RFC 5987) """
+    fallback = "".join([c if " " <= c < "\x7f" else "_" for c in filename])
+    return f"attachment; filename=\"{fallback}\"; filename*=UTF-8''{quote(filename, safe='')}"
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message=""):
+        super().__init__(message)
+        self.status = status
+        self.message = message or statuses[status]
+
+
+class ConversionServer(object):
+    """
+    Asyncio http server handing conversions to a process pool.
+    - workers: pool size (default one per core)
+    - queue: conversions allowed to wait for a free worker before replying 503
+    """
+    def __init__(self, host="127.0.0.1", port=8765, workers=None, queue=16):
+        self.host = host
+        self.port = port
+        self.workers = workers or os.cpu_count() or 1
+        self.pool = ProcessPoolExecutor(max_workers=self.workers)
+        self.capacity = self.workers + queue  # running + waiting
+        self.active = 0
+        self.counters = {"requests": 0, "converted": 0, "rejected": 0, "failed": 0}
+        self.server = None
+
+    async def start(self):
+        loop = asyncio.get_running_loop()
+        # start every worker now, so the first requests don't pay for it
+        await asyncio.gather(*[loop.run_in_executor(self.pool, warm_up) for i in range(self.workers)])
+        self.server = await asyncio.start_server(self.handle, self.host, self.port)
+        return self
+
+    async def close(self):
+        if self.server:
+            self.server.close()
+            await self.server.wait_closed()
+        self.pool.shutdown()
+
+    async def serve_forever(self):
+        async with self.server:
+            await self.server.serve_forever()
+
+    async def convert(self, function, *args):
+        """ Run function in the pool, or refuse if too much is waiting already """
+        if self.active >= self.capacity:
+            self.counters["rejected"] += 1
+            raise HTTPError(503, "Busy, try again shortly")
+        self.active += 1
+        try:
+            result = await asyncio.get_running_loop().run_in_executor(self.pool, function, *args)
+        except Exception as e:
+            self.counters["failed"] += 1
+            raise HTTPError(422, f"Could not convert: {type(e).__name__}: {e}")
+        finally:
+            self.active -= 1
+        self.counters["converted"] += 1
+        return result
+
+    async def read_request(self, reader):
+        """ method, path, query dict, body """
+        request_line = await reader.readline()
+        if not request_line:
+            return None
+        try:
+            method, target, version = request_line.decode('latin-1').split()
+        except ValueError:
+            raise HTTPError(400)
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode('latin-1').partition(":")
+            headers[name.strip().lower()] = value.strip()
+        length = int(headers.get("content-length", 0) or 0)
+        if length > max_upload:
+            raise HTTPError(413)
+        body = await reader.readexactly(length) if length else b""
+        url = urlsplit(target)
+        query = {k: v[0] for k, v in parse_qs(url.query).items()}
+        return method, url.path, query, body
+
+    async def route(self, method, path, query, body):
+        """ status, content type, body bytes, extra headers """
+        if path == "/health":
+            health = dict(self.counters, active=self.active, workers=self.workers, capacity=self.capacity)
+            return 200, "application/json", json.dumps(health).encode('utf-8'), {}
+        if path not in ("/convert", "/batch"):
+            raise HTTPError(404)
+        if method != "POST":
+            raise HTTPError(405)
+        if not body:
+            raise HTTPError(400, "No file in request body")
+        filename = safe_filename(query.get("name", ""))
+        try:
+            treadle_limit = int(query.get("treadles", 0)) or None
+        except ValueError:
+            raise HTTPError(400, "treadles must be a number")
+        if path == "/convert":
+            try:
+                colorway = int(query.get("colorway", 1)) - 1
+            except ValueError:
+                raise HTTPError(400, "colorway must be a number")
+            wif_filename, wif = await self.convert(convert_wif, body, filename, colorway, treadle_limit)
+            return 200, "text/plain; charset=utf-8", wif.encode('utf-8'), {"Content-Disposition": content_disposition(wif_filename)}
+        zipped = await self.convert(convert_zip, body, filename, treadle_limit)
+        zip_filename = filename.rpartition(".")[0] or filename
+        return 200, "application/zip", zipped, {"Content-Disposition": content_disposition(f"{zip_filename}_wifs.zip")}
+
+    def response(self, status, content_type, body, headers):
+        """ Bytes of the reply """
+        head = [f"HTTP/1.1 {status} {statuses[status]}",
+                f"Content-Type: {content_type}",
+                f"Content-Length: {len(body)}",
+                "Connection: close"]
+        head.extend([f"{k}: {v}" for k, v in headers.items()])
+        return ("\r\n".join(head) + "\r\n\r\n").encode('latin-1') + body
+
+    async def handle(self, reader, writer):
+        """ One connection, one request """
+        try:
+            try:
+                request = await self.read_request(reader)
+                if request is None:
+                    return
+                self.counters["requests"] += 1
+                status, content_type, body, headers = await self.route(*request)
+            except HTTPError as e:
+                status, content_type, body, headers = e.status, "text/plain; charset=utf-8", e.message.encode('utf-8'), {}
+                if e.status == 503:
+                    headers["Retry-After"] = "1"
+            except (asyncio.IncompleteReadError, ValueError):
+                status, content_type, body, headers = 400, "text/plain; charset=utf-8", b"Bad Request", {}
+            except Exception:
+                status, content_type, body, headers = 500, "text/plain; charset=utf-8", b"Internal Server Error", {}
+            try:
+                response = self.response(status, content_type, body, headers)
+            except Exception:  # a reply is always sent, rather than dropping the connection
+                response = self.response(500, "text/plain; charset=utf-8", b"Internal Server Error", {})
+            writer.write(response)
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+
+async def serve(host, port, workers, queue):
+    server = await ConversionServer(host, port, workers, queue).start()
+    print(f"Converting on http://{server.host}:{server.port}/ with {server.workers} workers")
+    try:
+        await server.serve_forever()
+    finally:
+        await server.close()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Local http service converting WeaveMaker files to wif.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("-j", "--workers", type=int, default=None, help="worker processes (default: one per core)")
+    parser.add_argument("--queue", type=int, default=16, help="conversions allowed to wait before replying 503")
+    args = parser.parse_args(argv)
+    try:
+        asyncio.run(serve(args.host, args.port, args.workers, args.queue))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,98 @@
+#startup_bench
+
+# Cold start comparison of CPython and MicroPython running weavemaker.py.
+# Each run is a fresh interpreter process which:
+#  - imports weavemaker,
+#  - converts a synthetic wmdf file (from wmdf_synth) and writes the wif.
+# Reports process wall time, import time and conversion time (median of the runs),
+# and checks every interpreter wrote the same wif.
+# Needs the MicroPython unix port (https://micropython.org) on the path as 'micropython',
+# or give its location with --micropython.
+#
+# Usage:
+#   python startup_bench.py [--runs 10] [--micropython /path/to/micropython] [--picks 2000]
+
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+from wmdf_synth import write_wmdf
+
+# Run by each interpreter, so only what MicroPython has too.
+child_code = """
+import sys, time
+sys.path.insert(0, {repo!r})
+def now():
+    if hasattr(time, "ticks_us"):
+        return time.ticks_us()
+    return int(time.perf_counter() * 1000000)
+start = now()
+import weavemaker
+imported = now()
+f = open({source!r}, "rb")
+contents = f.read()
+f.close()
+data, colors = weavemaker.parse_wmdf(contents)
+w = weavemaker.WMDF(data, colors, "startup.wmdf")
+f = open({output!r}, "w")
+w.write_wif(f, 0)
+f.close()
+converted = now()
+print(imported - start, converted - imported)
+"""
+
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+def time_interpreter(interpreter, source, output, runs):
+    """ {wall, import, convert} medians in ms for runs fresh processes """
+    code = child_code.format(repo=os.path.dirname(os.path.abspath(__file__)), source=source, output=output)
+    walls, imports, converts = [], [], []
+    for i in range(runs):
+        start = time.perf_counter()
+        result = subprocess.run([interpreter, "-c", code], capture_output=True, text=True)
+        walls.append((time.perf_counter() - start) * 1000)
+        if result.returncode:
+            raise RuntimeError(f"{interpreter} failed:\n{result.stderr}")
+        imported, converted = result.stdout.split()
+        imports.append(int(imported) / 1000)
+        converts.append(int(converted) / 1000)
+    return {"wall": median(walls), "import": median(imports), "convert": median(converts)}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare CPython and MicroPython start up on weavemaker.py.")
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--micropython", default=shutil.which("micropython"), help="MicroPython unix port executable")
+    parser.add_argument("--shafts", type=int, default=16)
+    parser.add_argument("--picks", type=int, default=2000)
+    args = parser.parse_args(argv)
+    interpreters = [["CPython", sys.executable]]
+    if args.micropython:
+        interpreters.append(["MicroPython", args.micropython])
+    else:
+        print("MicroPython not found (use --micropython), timing CPython only.")
+    with tempfile.TemporaryDirectory() as directory:
+        source = os.path.join(directory, "startup.wmdf")
+        write_wmdf(source, shafts=args.shafts, ends=args.picks, picks=args.picks, colorways=3)
+        wifs = []
+        print(f"{'':<12} {'process':>10} {'import':>10} {'convert':>10}  (median ms of {args.runs} runs)")
+        for name, interpreter in interpreters:
+            output = os.path.join(directory, f"{name}.wif")
+            times = time_interpreter(interpreter, source, output, args.runs)
+            print(f"{name:<12} {times['wall']:>10.1f} {times['import']:>10.1f} {times['convert']:>10.1f}")
+            with open(output, 'rb') as f:
+                wifs.append(f.read())
+        if any([wif != wifs[0] for wif in wifs]):
+            print("!!The interpreters wrote different wifs")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,153 @@
+#test_batch
+
+# Archive members convert like files on disk, and must not be written outside the
+# output (zip slip).
+#
+# Usage:
+#   python -m unittest test_batch
+
+import os
+import io
+import tarfile
+import zipfile
+import tempfile
+import unittest
+
+from batch import run_batch, member_folder
+from weavemaker import parse_wmdf, WMDF
+from wmdf_synth import make_wmdf
+
+unsafe_members = ["../../escaped/evil.wmdf", "/tmp/absolute/evil.wmdf", "ok/../../evil.wmdf", "..\\evil.wmdf"]
+safe_members = ["good.wmdf", "./sub/good.wmdf"]
+
+
+class ArchiveSlipTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = self.tmp.name
+        self.contents = make_wmdf()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def make_zip(self):
+        path = os.path.join(self.root, "in", "bundle.zip")
+        os.makedirs(os.path.dirname(path))
+        with zipfile.ZipFile(path, 'w') as z:
+            for name in unsafe_members + safe_members:
+                z.writestr(zipfile.ZipInfo(name), self.contents)  # ZipInfo keeps the name as given
+        return path
+
+    def make_tar(self):
+        path = os.path.join(self.root, "in", "bundle.tar")
+        os.makedirs(os.path.dirname(path))
+        with tarfile.open(path, 'w') as t:
+            for name in unsafe_members + safe_members:
+                info = tarfile.TarInfo(name)
+                info.size = len(self.contents)
+                t.addfile(info, io.BytesIO(self.contents))
+        return path
+
+    def written(self):
+        """ Every file below the temporary root, relative to it """
+        found = []
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            found.extend([os.path.relpath(os.path.join(dirpath, f), self.root) for f in filenames])
+        return sorted(found)
+
+    def check_directory_output(self, archive):
+        totals = run_batch(archive, os.path.join(self.root, "out"), jobs=1)
+        self.assertEqual(len(totals["failures"]), len(unsafe_members))
+        self.assertEqual(totals["converted"], len(safe_members))
+        outside = [p for p in self.written() if not p.startswith(("out" + os.sep, "in" + os.sep))]
+        self.assertEqual(outside, [])
+        self.assertFalse(os.path.exists("/tmp/absolute/evil_colorway1.wif"))
+
+    def check_zip_output(self, archive):
+        output = os.path.join(self.root, "out", "wifs.zip")
+        totals = run_batch(archive, output, jobs=1)
+        self.assertEqual(len(totals["failures"]), len(unsafe_members))
+        with zipfile.ZipFile(output) as z:
+            names = z.namelist()
+        self.assertEqual(sorted(names), ["good_colorway1.wif", "sub/good_colorway1.wif"])
+
+    def test_zip_to_directory(self):
+        self.check_directory_output(self.make_zip())
+
+    def test_tar_to_directory(self):
+        self.check_directory_output(self.make_tar())
+
+    def test_zip_to_zip(self):
+        self.check_zip_output(self.make_zip())
+
+    def test_tar_to_zip(self):
+        self.check_zip_output(self.make_tar())
+
+    def test_member_folder(self):
+        self.assertEqual(member_folder("a/b/c.wmdf"), "a/b")
+        self.assertEqual(member_folder("./c.wmdf"), "")
+        for name in unsafe_members + ["C:/evil.wmdf"]:
+            self.assertRaises(ValueError, member_folder, name)
+
+
+class ArchiveContentsTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = self.tmp.name
+        self.drafts = {"a.wmdf": make_wmdf(colorways=2), "sub/b.wmdf": make_wmdf(liftplan=True, seed=1)}
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def expected(self):
+        """ {output path: wif} as converting each file on its own gives """
+        result = {}
+        for name, contents in self.drafts.items():
+            data, colors = parse_wmdf(contents)
+            folder = os.path.dirname(name)
+            for wif_filename, wif in WMDF(data, colors, os.path.basename(name)).make_wifs():
+                result[os.path.join(folder, wif_filename)] = wif
+        return result
+
+    def read_output(self, output):
+        result = {}
+        for dirpath, dirnames, filenames in os.walk(output):
+            for f in filenames:
+                with open(os.path.join(dirpath, f), encoding='utf-8', newline='') as wif:
+                    result[os.path.relpath(os.path.join(dirpath, f), output)] = wif.read()
+        return result
+
+    def make_archive(self, kind):
+        path = os.path.join(self.root, "bundle." + kind)
+        if kind == "zip":
+            with zipfile.ZipFile(path, 'w') as z:
+                for name, contents in self.drafts.items():
+                    z.writestr(name, contents)
+        else:
+            with tarfile.open(path, 'w') as t:
+                for name, contents in self.drafts.items():
+                    info = tarfile.TarInfo(name)
+                    info.size = len(contents)
+                    t.addfile(info, io.BytesIO(contents))
+        return path
+
+    def check(self, kind, cache_dir=None):
+        output = os.path.join(self.root, "out-" + kind)
+        totals = run_batch(self.make_archive(kind), output, jobs=1, cache_dir=cache_dir)
+        self.assertEqual([totals["files"], totals["converted"], totals["wifs"], totals["failures"]], [2, 2, 3, []])
+        self.assertEqual(self.read_output(output), self.expected())
+
+    def test_zip(self):
+        self.check("zip")
+
+    def test_tar(self):
+        self.check("tar")
+
+    def test_cached(self):
+        cache_dir = os.path.join(self.root, "cache")
+        self.check("zip", cache_dir)
+        self.check("tar", cache_dir)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,61 @@
+#test_catalog
+
+# The catalog stores what the converter reports, tromp-as-writ drafts included.
+#
+# Usage:
+#   python -m unittest test_catalog
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from catalog import open_catalog, scan_library, query_drafts
+
+corpus_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "corpus")
+
+
+class CatalogTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.library = os.path.join(self.tmp.name, "library")
+        os.makedirs(self.library)
+        for name in ["tieup-8s.wmdf", "liftplan-8s.wmdf", "taw-normal.wmdf"]:
+            shutil.copy(os.path.join(corpus_dir, name), self.library)
+        self.conn = open_catalog(os.path.join(self.tmp.name, "catalog.sqlite"))
+
+    def tearDown(self):
+        self.conn.close()
+        self.tmp.cleanup()
+
+    def rows(self):
+        return {os.path.basename(r["path"]): r for r in query_drafts(self.conn)}
+
+    def test_counts(self):
+        counts = scan_library(self.conn, self.library)
+        self.assertEqual(counts["added"], 3)
+        self.assertEqual(counts["failed"], 0)
+        rows = self.rows()
+        tieup = rows["tieup-8s.wmdf"]
+        self.assertEqual([tieup["shafts"], tieup["treadles"], tieup["warps"], tieup["wefts"], tieup["liftplan"]],
+                         [8, 8, 200, 200, 0])
+        self.assertEqual(rows["liftplan-8s.wmdf"]["liftplan"], 1)
+
+    def test_tromp_as_writ(self):
+        scan_library(self.conn, self.library)
+        taw = self.rows()["taw-normal.wmdf"]
+        # the treadling is the threading: a treadle per shaft, a weft per warp
+        self.assertEqual([taw["shafts"], taw["treadles"], taw["warps"], taw["wefts"]], [8, 8, 160, 160])
+
+    def test_rescan(self):
+        scan_library(self.conn, self.library)
+        counts = scan_library(self.conn, self.library)
+        self.assertEqual(counts["unchanged"], 3)
+        os.remove(os.path.join(self.library, "liftplan-8s.wmdf"))
+        counts = scan_library(self.conn, self.library)
+        self.assertEqual(counts["removed"], 1)
+        self.assertEqual(sorted(self.rows()), ["taw-normal.wmdf", "tieup-8s.wmdf"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,88 @@
+#test_drawdown
+
+# The bitmask drawdown must colour every cell as the draft says, cell by cell.
+#
+# Usage:
+#   python -m unittest test_drawdown
+
+import io
+import zlib
+import struct
+import unittest
+
+from drawdown import Drawdown
+from weavemaker import parse_wmdf, WMDF
+from wmdf_synth import make_wmdf
+
+
+def load(**options):
+    data, colors = parse_wmdf(make_wmdf(**options))
+    return WMDF(data, colors, "draft.wmdf")
+
+def cell(drawdown, end, pick):
+    """ rgb of one cell, worked out the slow way """
+    shaft = drawdown.end_shafts[end]
+    if shaft >= 0 and (drawdown.pick_lifts[pick] >> shaft) & 1:
+        return bytes(drawdown.end_colors[end])
+    return bytes(drawdown.pick_colors[pick])
+
+def read_png(contents):
+    """ width, height, [row bytes, ...] of an unfiltered 8 bit rgb PNG """
+    i, idat = 8, b""
+    while i < len(contents):
+        length, kind = struct.unpack('>I4s', contents[i:i+8])
+        data = contents[i+8:i+8+length]
+        if kind == b'IHDR':
+            width, height = struct.unpack('>II', data[:8])
+        elif kind == b'IDAT':
+            idat += data
+        i += 12 + length
+    raw = zlib.decompress(idat)
+    stride = 3 * width + 1
+    return width, height, [raw[r*stride+1:(r+1)*stride] for r in range(height)]
+
+
+class DrawdownTest(unittest.TestCase):
+    def check_cells(self, drawdown, ends, picks):
+        for row, pick in zip(drawdown.rows(ends, picks), picks):
+            self.assertEqual(row, b"".join([cell(drawdown, end, pick) for end in ends]))
+
+    def test_tieup(self):
+        drawdown = Drawdown(load(colorways=2, noise=0.2, seed=3), 1)
+        ends, picks = drawdown.sample()
+        self.check_cells(drawdown, ends, picks)
+
+    def test_liftplan(self):
+        drawdown = Drawdown(load(liftplan=True, noise=0.2, seed=4))
+        self.check_cells(drawdown, *drawdown.sample())
+
+    def test_wide(self):
+        drawdown = Drawdown(load(shafts=40, treadles=36, ends=300, picks=120, noise=0.1, seed=5))
+        self.check_cells(drawdown, *drawdown.sample())
+
+    def test_sample(self):
+        drawdown = Drawdown(load(ends=300, picks=120))
+        ends, picks = drawdown.sample(max_size=100)
+        self.assertEqual([len(ends), len(picks)], [100, 40])
+        ends, picks = drawdown.sample(zoom=2)
+        self.assertEqual([len(ends), len(picks), ends[:4]], [600, 240, [0, 0, 1, 1]])
+        self.check_cells(drawdown, ends[:50], picks[:50])
+
+    def test_png(self):
+        drawdown = Drawdown(load(noise=0.2, seed=6))
+        ends, picks = list(range(0, 200, 3)), list(range(0, 200, 2))
+        buffer = io.BytesIO()
+        drawdown.write_png(buffer, ends, picks)
+        width, height, rows = read_png(buffer.getvalue())
+        self.assertEqual([width, height], [len(ends), len(picks)])
+        self.assertEqual(rows, list(drawdown.rows(ends, picks)))
+
+    def test_ppm(self):
+        drawdown = Drawdown(load())
+        buffer = io.BytesIO()
+        drawdown.write_ppm(buffer, [0, 1, 2], [5, 6])
+        self.assertEqual(buffer.getvalue(), b"P6\n3 2\n255\n" + b"".join(drawdown.rows([0, 1, 2], [5, 6])))
+
+
+if __name__ == "__main__":
+    unittest.main()
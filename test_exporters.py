@@ -0,0 +1,82 @@
+#test_exporters
+
+# Every export format from one parse, and the compact wmdb format read back.
+#
+# Usage:
+#   python -m unittest test_exporters
+
+import json
+import unittest
+
+from exporters import export, read_compact, exporters
+from weavemaker import parse_wmdf, WMDF
+from wmdf_synth import make_wmdf
+
+
+def load(contents, filename="draft.wmdf", **options):
+    data, colors = parse_wmdf(contents)
+    return WMDF(data, colors, filename, **options)
+
+
+class ExportersTest(unittest.TestCase):
+    def check_round_trip(self, draft):
+        contents = export(draft, ["wmdb"])["wmdb"][0][1]
+        back = read_compact(contents)
+        self.assertEqual([back["shafts"], back["ends"], back["picks"]],
+                         [draft.shaft_count, len(draft.threading), draft.weft_count])
+        self.assertEqual(back["is_liftplan"], bool(draft.liftplan))
+        self.assertEqual([back["name"], back["version"]], [draft.name, draft.version])
+        self.assertEqual(list(back["threading"]), list(draft.threading))
+        if draft.liftplan:
+            self.assertEqual(list(back["liftplan"]), list(draft.pegplan))
+            self.assertNotIn("treadling", back)
+        else:
+            self.assertEqual(list(back["treadling"]), list(draft.treadling))
+            self.assertEqual(list(back["tieup"]), list(draft.tieup))
+            self.assertNotIn("liftplan", back)
+        self.assertEqual(back["warp_colors"], list(draft.warp_colors))
+        self.assertEqual(back["weft_colors"], list(draft.weft_colors))
+        self.assertEqual(back["palettes"], [draft.build_wif_palette(c) for c in range(len(draft.c_mapping))])
+        return back
+
+    def test_tieup_round_trip(self):
+        self.check_round_trip(load(make_wmdf(colorways=3)))
+
+    def test_liftplan_round_trip(self):
+        self.check_round_trip(load(make_wmdf(liftplan=True)))
+
+    def test_wide_round_trip(self):
+        back = self.check_round_trip(load(make_wmdf(shafts=40, treadles=36, noise=0.1, seed=2)))
+        self.assertEqual(back["threading"].width, 40)
+
+    def test_treadled_liftplan(self):
+        draft = load(make_wmdf(liftplan=True), treadle_limit=8)
+        back = read_compact(export(draft, ["wmdb"])["wmdb"][0][1])
+        self.assertFalse(back["is_liftplan"])
+        self.assertNotIn("liftplan", back)
+        self.assertEqual(len(back["treadling"]), draft.weft_count)
+
+    def test_not_wmdb(self):
+        self.assertRaises(ValueError, read_compact, b"WIF!" + bytes(12))
+
+    def test_all_formats(self):
+        draft = load(make_wmdf(colorways=2))
+        result = export(draft)
+        self.assertEqual(sorted(result), sorted(exporters))
+        self.assertEqual(result["wif"], [[name, wif.encode('utf-8')] for name, wif in draft.make_wifs()])
+        document = json.loads(result["json"][0][1])
+        self.assertEqual([document["shafts"], document["ends"], document["picks"]], [8, 200, 200])
+        self.assertEqual(len(document["colorways"]), 2)
+        self.assertEqual([name for name, contents in result["wmdb"]], ["draft.wmdb"])
+
+    def test_colorways(self):
+        result = export(load(make_wmdf(colorways=3)), ["wif", "wmdb"], [2])
+        self.assertEqual([name for name, contents in result["wif"]], ["draft_colorway3.wif"])
+        self.assertEqual(len(read_compact(result["wmdb"][0][1])["palettes"]), 1)
+
+    def test_unknown_format(self):
+        self.assertRaises(ValueError, export, load(make_wmdf()), ["pdf"])
+
+
+if __name__ == "__main__":
+    unittest.main()
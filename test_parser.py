@@ -0,0 +1,83 @@
+#test_parser
+
+# The incremental WMDFParser must index a file the same as parse_wmdf does,
+# whatever sizes of chunks it arrives in, damaged files included.
+#
+# Usage:
+#   python -m unittest test_parser
+
+import io
+import os
+import json
+import random
+import unittest
+
+from weavemaker import parse_wmdf, parse_wmdf_file, WMDFParser, WMDF
+
+corpus_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "corpus")
+
+
+def corpus_files():
+    with open(os.path.join(corpus_dir, "corpus.json")) as f:
+        names = [case["name"] for case in json.load(f)["cases"]]
+    for name in names:
+        with open(os.path.join(corpus_dir, name + ".wmdf"), 'rb') as f:
+            yield name, f.read()
+
+def indexed(data):
+    """ {id: [size, offset, contents]} to compare parses by """
+    return {id: [s.size, s.offset, s.tobytes()] for id, s in data.items()}
+
+
+class WMDFParserTest(unittest.TestCase):
+    def feed_randomly(self, contents, rnd, largest):
+        """ data, colors, diagnostics and the segments feed() returned, from random chunk sizes """
+        diagnostics = []
+        parser = WMDFParser(diagnostics=diagnostics)
+        fed = []
+        i = 0
+        while i < len(contents):
+            size = rnd.randint(1, largest)
+            fed.extend(parser.feed(contents[i:i+size]))
+            i += size
+        data, colors = parser.close()
+        return data, colors, diagnostics, fed
+
+    def test_random_chunks(self):
+        rnd = random.Random(14)
+        for name, contents in corpus_files():
+            expected_diagnostics = []
+            expected, colors = parse_wmdf(contents, diagnostics=expected_diagnostics)
+            for largest in [1, 7, 64, 4096]:
+                data, streamed_colors, diagnostics, fed = self.feed_randomly(contents, rnd, largest)
+                with self.subTest(case=name, largest=largest):
+                    self.assertEqual(list(data), list(expected))
+                    self.assertEqual(indexed(data), indexed(expected))
+                    self.assertEqual(len(streamed_colors), len(colors))
+                    self.assertEqual(diagnostics, expected_diagnostics)
+                    # what feed() hands out early is what close() ends up with
+                    for segment in fed:
+                        self.assertIs(data[segment.id], segment)
+
+    def test_same_wifs(self):
+        for name, contents in corpus_files():
+            if name == "large-5000":
+                continue
+            data, colors = parse_wmdf_file(io.BytesIO(contents), chunk_size=97)
+            with self.subTest(case=name):
+                self.assertEqual(WMDF(data, colors, name + ".wmdf").make_wifs(),
+                                 WMDF(*parse_wmdf(contents), name + ".wmdf").make_wifs())
+
+    def test_not_weavemaker(self):
+        parser = WMDFParser()
+        self.assertRaises(ValueError, parser.feed, b"\x00\x10Xjunk")
+
+    def test_truncated(self):
+        contents = dict(corpus_files())["tieup-8s"]
+        parser = WMDFParser()
+        parser.feed(contents[:2])
+        self.assertRaises(ValueError, parser.close)
+
+
+if __name__ == "__main__":
+    unittest.main()
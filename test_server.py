@@ -0,0 +1,122 @@
+#test_server
+
+# The conversion service's replies, error paths and download file names.
+#
+# Usage:
+#   python -m unittest test_server
+
+import io
+import asyncio
+import zipfile
+import unittest
+
+from server import ConversionServer, safe_filename, content_disposition
+from wmdf_synth import make_wmdf
+
+
+class ServerTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.server = await ConversionServer(port=0, workers=1, queue=1).start()
+        self.port = self.server.server.sockets[0].getsockname()[1]
+        self.contents = make_wmdf(colorways=2)
+
+    async def asyncTearDown(self):
+        await self.server.close()
+
+    async def request(self, method, target, body=b"", raw=None):
+        """ status, {header: value}, body """
+        reader, writer = await asyncio.open_connection("127.0.0.1", self.port)
+        if raw is None:
+            raw = f"{method} {target} HTTP/1.1\r\nContent-Length: {len(body)}\r\n\r\n".encode('latin-1') + body
+        writer.write(raw)
+        await writer.drain()
+        reply = await reader.read()
+        writer.close()
+        head, _, content = reply.partition(b"\r\n\r\n")
+        lines = head.decode('latin-1').split("\r\n")
+        headers = {}
+        for line in lines[1:]:
+            name, _, value = line.partition(":")
+            headers[name.strip()] = value.strip()
+        return int(lines[0].split()[1]), headers, content
+
+    async def test_convert(self):
+        status, headers, body = await self.request("POST", "/convert?name=draft.wmdf&colorway=2", self.contents)
+        self.assertEqual(status, 200)
+        self.assertTrue(body.startswith(b"[WIF]"))
+        self.assertIn('filename="draft_colorway2.wif"', headers["Content-Disposition"])
+
+    async def test_batch(self):
+        status, headers, body = await self.request("POST", "/batch?name=draft.wmdf", self.contents)
+        self.assertEqual(status, 200)
+        with zipfile.ZipFile(io.BytesIO(body)) as z:
+            self.assertEqual(sorted(z.namelist()), ["draft_colorway1.wif", "draft_colorway2.wif"])
+        self.assertIn('filename="draft_wifs.zip"', headers["Content-Disposition"])
+
+    async def test_health(self):
+        status, headers, body = await self.request("GET", "/health")
+        self.assertEqual(status, 200)
+        self.assertIn(b'"workers": 1', body)
+
+    async def test_bad_requests(self):
+        for target, body in [["/convert", b""], ["/convert?colorway=x", self.contents],
+                             ["/convert?treadles=x", self.contents]]:
+            status, headers, content = await self.request("POST", target, body)
+            self.assertEqual(status, 400, target)
+        status, headers, content = await self.request("", "", raw=b"nonsense\r\n\r\n")
+        self.assertEqual(status, 400)
+
+    async def test_not_found(self):
+        status, headers, body = await self.request("POST", "/elsewhere", self.contents)
+        self.assertEqual(status, 404)
+
+    async def test_wrong_method(self):
+        status, headers, body = await self.request("GET", "/convert")
+        self.assertEqual(status, 405)
+
+    async def test_unconvertible(self):
+        status, headers, body = await self.request("POST", "/convert", b"not a weavemaker file")
+        self.assertEqual(status, 422)
+        status, headers, body = await self.request("POST", "/convert?colorway=9", self.contents)
+        self.assertEqual(status, 422)
+
+    async def test_busy(self):
+        self.server.capacity = 0
+        status, headers, body = await self.request("POST", "/convert", self.contents)
+        self.assertEqual(status, 503)
+        self.assertEqual(headers["Retry-After"], "1")
+
+    async def test_unicode_name(self):
+        status, headers, body = await self.request("POST", "/convert?name=%E4%B8%AD.wmdf", self.contents)
+        self.assertEqual(status, 200)
+        self.assertIn("filename*=UTF-8''%E4%B8%AD_colorway1.wif", headers["Content-Disposition"])
+
+    async def test_header_injection(self):
+        status, headers, body = await self.request("POST", "/convert?name=a%0d%0aX-Injected:%201.wmdf", self.contents)
+        self.assertEqual(status, 200)
+        self.assertNotIn("X-Injected", headers)
+
+    async def test_internal_error(self):
+        async def broken(*args):
+            raise RuntimeError("broken")
+        self.server.route = broken
+        status, headers, body = await self.request("POST", "/convert", self.contents)
+        self.assertEqual(status, 500)
+
+
+class FilenameTest(unittest.TestCase):
+    def test_safe_filename(self):
+        self.assertEqual(safe_filename("../../dir/draft.wmdf"), "draft.wmdf")
+        self.assertEqual(safe_filename("C:\\dir\\draft.wmdf"), "draft.wmdf")
+        self.assertEqual(safe_filename('a"b\r\n.wmdf'), "ab.wmdf")
+        self.assertEqual(safe_filename(".."), "upload.wmdf")
+        self.assertEqual(safe_filename(""), "upload.wmdf")
+
+    def test_content_disposition(self):
+        value = content_disposition("café.wif")
+        self.assertEqual(value, "attachment; filename=\"caf_.wif\"; filename*=UTF-8''caf%C3%A9.wif")
+        value.encode('latin-1')
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,74 @@
+#test_wif_cache
+
+# Conversion cache hits, misses, eviction and invalidation by converter version.
+#
+# Usage:
+#   python -m unittest test_wif_cache
+
+import tempfile
+import unittest
+from unittest import mock
+
+import wif_cache
+from wif_cache import ConversionCache
+from weavemaker import parse_wmdf, WMDF
+from wmdf_synth import make_wmdf
+
+
+class ConversionCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.contents = make_wmdf(colorways=2)
+
+    def expected(self, filename):
+        data, colors = parse_wmdf(self.contents)
+        return WMDF(data, colors, filename).make_wifs()
+
+    def test_hits_and_misses(self):
+        cache = ConversionCache()
+        wifs = cache.get_wifs(self.contents, "a.wmdf")
+        self.assertEqual(wifs, self.expected("a.wmdf"))
+        self.assertEqual([cache.hits, cache.misses, cache.draft_hits, cache.draft_misses], [0, 1, 0, 1])
+        self.assertEqual(cache.get_wifs(self.contents, "a.wmdf"), wifs)
+        self.assertEqual([cache.hits, cache.misses, cache.draft_hits, cache.draft_misses], [1, 1, 0, 1])
+        # another colorway renders, but from the draft already parsed
+        self.assertEqual(cache.get_wif(self.contents, "a.wmdf", 1), wifs[1])
+        self.assertEqual([cache.hits, cache.misses, cache.draft_hits, cache.draft_misses], [1, 2, 1, 1])
+
+    def test_filename(self):
+        cache = ConversionCache()
+        cache.get_wifs(self.contents, "a.wmdf")
+        wifs = cache.get_wifs(self.contents, "b.wmdf")
+        self.assertEqual(wifs, self.expected("b.wmdf"))
+        self.assertEqual([cache.misses, cache.draft_hits], [2, 1])
+
+    def test_eviction(self):
+        cache = ConversionCache(max_entries=2)
+        for seed in range(3):
+            cache.get_wifs(make_wmdf(seed=seed), "a.wmdf")
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.evictions, 4)
+
+    def test_disk(self):
+        with tempfile.TemporaryDirectory() as directory:
+            wifs = ConversionCache(directory=directory).get_wifs(self.contents, "a.wmdf")
+            cache = ConversionCache(directory=directory)
+            self.assertEqual(cache.get_wifs(self.contents, "a.wmdf"), wifs)
+            self.assertEqual([cache.hits, cache.disk_hits, cache.misses, cache.draft_misses], [1, 1, 0, 0])
+
+    def test_version_invalidates(self):
+        with tempfile.TemporaryDirectory() as directory:
+            cache = ConversionCache(directory=directory)
+            cache.get_wifs(self.contents, "a.wmdf")
+            with mock.patch.object(wif_cache, "__version__", "0.0-test"):
+                cache.get_wifs(self.contents, "a.wmdf")
+                self.assertEqual([cache.hits, cache.misses, cache.draft_misses], [0, 2, 2])
+                fresh = ConversionCache(directory=directory)
+                fresh.get_wifs(self.contents, "a.wmdf")
+                self.assertEqual([fresh.disk_hits, fresh.misses], [1, 0])  # saved by the line above
+            fresh = ConversionCache(directory=directory)
+            fresh.get_wifs(self.contents, "a.wmdf")
+            self.assertEqual([fresh.disk_hits, fresh.misses], [1, 0])
+
+
+if __name__ == "__main__":
+    unittest.main()
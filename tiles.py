@@ -0,0 +1,160 @@
+#tiles
+
+# Pan and zoom previews of large drafts: the drawdown (see drawdown.py) as a pyramid of
+# square PNG tiles, each rendered when first asked for.
+#  - zoom 0 fits the whole cloth in one tile, each zoom level doubles the size,
+#    max_zoom is one pixel per thread and levels past it magnify (2, 4, .. pixels a thread)
+#  - most drafts repeat: a tile is keyed by what its ends (shaft + color) and picks
+#    (lifts + color) draw, not by where it is, so each repeat of a pattern is rendered once
+#    however often it appears, also in drafts with borders or irregular repeats
+#  - rendered tiles are kept in an LRU cache limited in entries and bytes
+#
+# Usage:
+#   python tiles.py file.wmdf [--colorway 1] [--zoom 2] [--out tiles_dir]
+#     prints the pyramid's levels, and writes that zoom level's tiles as tiles_dir/z/x/y.png
+
+import io
+import os
+import sys
+import hashlib
+import argparse
+
+from weavemaker import read_weavemaker, parse_wmdf, WMDF
+from wif_cache import ConversionCache
+from drawdown import Drawdown
+
+tile_size = 256
+max_magnify = 4  # zoom levels past one pixel per thread
+row_limit = 8192  # rows the drawdown may cache before it is cleared
+
+
+def thread_signatures(masks, colors):
+    """
+    bytes saying what each thread draws: its shaft (or lifts mask) and rgb.
+    - threads drawing the same share one bytes object
+    """
+    signatures = {}
+    result = []
+    for mask, rgb in zip(masks, colors):
+        key = (mask, tuple(rgb))
+        if key not in signatures:
+            signatures[key] = f"{mask:x}".encode('ascii') + b":" + bytes(rgb) + b";"  # ':' and ';' fix the rgb
+        result.append(signatures[key])
+    return result
+
+def threads_key(signatures, threads):
+    """ Short key for what the threads draw, in order """
+    return hashlib.blake2b(b"".join([signatures[i] for i in threads]), digest_size=16).digest()
+
+
+class TilePyramid(object):
+    """
+    Drawdown tiles of a (loaded) WMDF in one colorway.
+    - tile(zoom, x, y): PNG bytes of the tile, x/y count tiles from the top left
+    - info(): sizes of each zoom level, for a viewer
+    - cache can be a ConversionCache shared between pyramids
+    """
+    def __init__(self, draft, colorway=0, size=tile_size, cache=None):
+        self.drawdown = Drawdown(draft, colorway)
+        self.size = size
+        self.cache = cache if cache is not None else ConversionCache(max_entries=2048, max_bytes=32*1024*1024)
+        d = self.drawdown
+        self.end_signatures = thread_signatures([s + 1 for s in d.end_shafts], d.end_colors)  # 0 = unthreaded
+        self.pick_signatures = thread_signatures(d.pick_lifts, d.pick_colors)
+        longest = max(d.ends, d.picks, 1)
+        self.max_zoom = 0
+        while -(-longest // (1 << self.max_zoom)) > size:
+            self.max_zoom += 1
+        self.hits = 0
+        self.misses = 0
+
+    def __repr__(self):
+        return (f"<TilePyramid: {self.drawdown.ends}x{self.drawdown.picks}, zoom 0-{self.max_zoom + max_magnify},"
+                f" {self.hits} hits, {self.misses} misses>")
+
+    def scale(self, zoom):
+        """ [step, repeat]: every step'th thread is drawn, repeat pixels wide """
+        if not 0 <= zoom <= self.max_zoom + max_magnify:
+            raise IndexError(f"zoom {zoom} not in 0-{self.max_zoom + max_magnify}")
+        if zoom <= self.max_zoom:
+            return 1 << (self.max_zoom - zoom), 1
+        return 1, 1 << (zoom - self.max_zoom)
+
+    def level_size(self, zoom):
+        """ [width, height] in pixels of the whole cloth at zoom """
+        step, repeat = self.scale(zoom)
+        return [-(-self.drawdown.ends // step) * repeat, -(-self.drawdown.picks // step) * repeat]
+
+    def info(self):
+        levels = []
+        for zoom in range(self.max_zoom + max_magnify + 1):
+            width, height = self.level_size(zoom)
+            levels.append({"zoom": zoom, "width": width, "height": height,
+                           "columns": -(-width // self.size), "rows": -(-height // self.size)})
+        return {"ends": self.drawdown.ends, "picks": self.drawdown.picks, "tile_size": self.size,
+                "levels": levels}
+
+    def threads(self, first, count, step, repeat):
+        """ Thread indices for count pixels from pixel first """
+        return [((first + k) // repeat) * step for k in range(count)]
+
+    def tile(self, zoom, x, y):
+        """ PNG bytes of tile x, y at zoom """
+        step, repeat = self.scale(zoom)
+        width, height = self.level_size(zoom)
+        left, top = x * self.size, y * self.size
+        if not (0 <= left < width and 0 <= top < height):
+            raise IndexError(f"tile {x},{y} not in zoom {zoom} ({-(-width // self.size)}x{-(-height // self.size)} tiles)")
+        ends = self.threads(left, min(self.size, width - left), step, repeat)
+        picks = self.threads(top, min(self.size, height - top), step, repeat)
+        # what each column and row draws fixes the pixels, wherever, in whatever draft and
+        # at whatever zoom they are, so shared caches are keyed on that alone
+        key = ("tile", threads_key(self.end_signatures, ends), threads_key(self.pick_signatures, picks))
+        png = self.cache.lookup(key)
+        if png is not None:
+            self.hits += 1
+            return png
+        self.misses += 1
+        buffer = io.BytesIO()
+        self.drawdown.write_png(buffer, ends, picks)
+        if len(self.drawdown.row_cache) > row_limit:
+            self.drawdown.forget()
+        png = buffer.getvalue()
+        self.cache.store(key, png, len(png))
+        return png
+
+
+def load_pyramid(src, colorway=0, size=tile_size, cache=None):
+    """ TilePyramid of the wmd/wmdf file src """
+    data, colors = parse_wmdf(read_weavemaker(src))
+    draft = WMDF(data, colors, os.path.basename(src), lazy=True)
+    return TilePyramid(draft, colorway, size, cache)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Drawdown preview tiles of a WeaveMaker file.")
+    parser.add_argument("input", help="wmd/wmdf file")
+    parser.add_argument("--colorway", type=int, default=1, help="colorway to use (from 1)")
+    parser.add_argument("--size", type=int, default=tile_size, help="tile side in pixels")
+    parser.add_argument("--zoom", type=int, default=0, help="zoom level to write")
+    parser.add_argument("--out", help="directory to write the zoom level's tiles to")
+    args = parser.parse_args(argv)
+    pyramid = load_pyramid(args.input, args.colorway - 1, args.size)
+    info = pyramid.info()
+    print(f"{args.input}: {info['ends']}x{info['picks']}")
+    for level in info["levels"]:
+        print(f" - zoom {level['zoom']}: {level['width']}x{level['height']} pixels, {level['columns']}x{level['rows']} tiles")
+    if args.out:
+        level = info["levels"][args.zoom]
+        for x in range(level["columns"]):
+            folder = os.path.join(args.out, str(args.zoom), str(x))
+            os.makedirs(folder, exist_ok=True)
+            for y in range(level["rows"]):
+                with open(os.path.join(folder, f"{y}.png"), 'wb') as f:
+                    f.write(pyramid.tile(args.zoom, x, y))
+        print(pyramid)
+        print(f"{len(pyramid.cache)} tiles cached, {pyramid.cache.size} bytes")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,9 +1,31 @@
 #weavemaker
 
-from struct import unpack, calcsize
+from struct import unpack, unpack_from, calcsize
+try:
+    from struct import Struct
+except ImportError:  # MicroPython
+    class Struct(object):
+        """ The part of struct.Struct used here """
+        def __init__(self, format):
+            self.format = format
+            self.size = calcsize(format)
+
+        def unpack_from(self, buffer, offset=0):
+            return unpack_from(self.format, buffer, offset)
+try:
+    from time import perf_counter as clock
+    def seconds_since(start):
+        return clock() - start
+except ImportError:  # MicroPython
+    from time import ticks_us as clock, ticks_diff
+    def seconds_since(start):
+        return ticks_diff(clock(), start) / 1000000
 
 # https://weavemaker.com/downloads/
 
+# Bump when the wif output changes (it is part of conversion cache keys).
+__version__ = "1.3"
+
 
 # Format for wmdf file is:
 # 2 byte BE offset jumps past Color 'Q' info, to remaining chunks of data.
@@ -76,50 +98,128 @@ known = {"C": [True, " - Colorway",],
          "8": [False, " - File creation date",]
          }
 
-def build_wif_header(title, threading, liftplan=False, need_warpcolor=True, need_weftcolor=True):
+def wif_actives_lines(bitrows):
+    """
+    Yield a "row=active,active" line for each row of a BitRows.
+    - rows and actives are numbered from 1
+    """
+    joined = {}  # repeated rows are only joined once
+    for i in range(len(bitrows)):
+        mask = bitrows[i]
+        actives = joined.get(mask)
+        if actives is None:
+            actives = ",".join([str(a+1) for a in bitrows.actives(i)])
+            joined[mask] = actives
+        yield f"{i+1}={actives}\n"
+
+def iter_wif_header(title, threading_lines, liftplan=False, need_warpcolor=True, need_weftcolor=True):
+    """
+    Header, contents, title and threading.
+    - threading_lines are newline terminated "end=shaft" lines
+    """
     tieup_liftplan = "LIFTPLAN=true\n" if liftplan else "TIEUP=true\nTREADLING=true\n"
     warpcolors = "WARP COLORS=true\n" if need_warpcolor else ""
     weftcolors = "WEFT COLORS=true\n" if need_weftcolor else ""
-    return f"""[WIF]\nVersion=1.1\nDate=April 20, 1997\nDevelopers=wif@mhsoft.com\nSource Program=ISOweave online
+    yield f"""[WIF]\nVersion=1.1\nDate=April 20, 1997\nDevelopers=wif@mhsoft.com\nSource Program=ISOweave online
 Source Version=1.0\n\n[CONTENTS]\nCOLOR PALETTE=true\nTEXT=true\nWEAVING=true\nWARP=true\nWEFT=true
-COLOR TABLE=true\nTHREADING=true\nNOTES=true\n{warpcolors}{weftcolors}{tieup_liftplan}\n[TEXT]\nTitle={title}\n\n[THREADING]\n{threading}\n"""
+COLOR TABLE=true\nTHREADING=true\nNOTES=true\n{warpcolors}{weftcolors}{tieup_liftplan}\n[TEXT]\nTitle={title}\n\n[THREADING]\n"""
+    yield from threading_lines
 
-def build_wif_tie_treadle(tieup, treadling):
+def build_wif_header(title, threading, liftplan=False, need_warpcolor=True, need_weftcolor=True):
+    return "".join(iter_wif_header(title, [threading + "\n"], liftplan, need_warpcolor, need_weftcolor))
+
+def iter_wif_tie_treadle(tieup_lines, treadling_lines):
     """
     only called if these are needed
     I.e. not liftplan
     """
-    return f"[TIEUP]\n{tieup}\n[TREADLING]\n{treadling}\n"
+    yield "[TIEUP]\n"
+    yield from tieup_lines
+    yield "\n[TREADLING]\n"
+    yield from treadling_lines
+    yield "\n"
 
-def build_wif_liftplan(liftplan):
+def build_wif_tie_treadle(tieup, treadling):
+    return "".join(iter_wif_tie_treadle([tieup], [treadling]))
+
+def iter_wif_liftplan(liftplan_lines):
     """
     only called if needed
     """
-    return f"\n[LIFTPLAN]\n{liftplan}\n"
+    yield "\n[LIFTPLAN]\n"
+    yield from liftplan_lines
+    yield "\n"
+
+def build_wif_liftplan(liftplan):
+    return "".join(iter_wif_liftplan([liftplan]))
 
 def build_wif_notes(notes_list):
     text = [f"{i+1}={n}\n" for i,n in enumerate(notes_list)]
     notes = "\n[NOTES]\n" + "".join(text) + "\n"
     return notes
 
-def build_wif_colors(need_warpcolor, warp_colors,
-                     need_weftcolor, weft_colors, palette):
+def iter_wif_thread_colors(need_warpcolor, warp_color_lines,
+                           need_weftcolor, weft_color_lines):
     """
-    Warp Colors, Weft Colors, Color Table, Color Palette
+    Warp Colors, Weft Colors
+    - color lines are newline terminated "thread=color" lines
     """
-    # [COLOR TABLE]\n1=255,255,255\n2=0,0,0\n\n[COLOR PALETTE]\nRange=0,255\nEntries=2\n
-    # [WARP COLORS] WEFT COLORS
-    result = ""
     if need_warpcolor:
-        result += f"[WARP COLORS]\n{warp_colors}\n"
+        yield "[WARP COLORS]\n"
+        yield from warp_color_lines
     if need_weftcolor:
-        result += f"[WEFT COLORS]\n{weft_colors}\n"
-    result += f"\n[COLOR PALETTE]\nRange=0,255\nEntries={len(palette)}\n"
-    result += "\n[COLOR TABLE]\n"
+        yield "[WEFT COLORS]\n"
+        yield from weft_color_lines
+
+def iter_wif_palette(palette):
+    """
+    Color Palette, Color Table
+    - the only sections that depend on the colorway
+    """
+    # [COLOR TABLE]\n1=255,255,255\n2=0,0,0\n\n[COLOR PALETTE]\nRange=0,255\nEntries=2\n
+    yield f"\n[COLOR PALETTE]\nRange=0,255\nEntries={len(palette)}\n"
+    yield "\n[COLOR TABLE]\n"
     for [i,c] in palette:
-        result += f"{i}={','.join([str(a) for a in c])}\n"
-    #print("Colors:",result)
-    return result
+        yield f"{i}={','.join([str(a) for a in c])}\n"
+
+def iter_wif_colors(need_warpcolor, warp_color_lines,
+                    need_weftcolor, weft_color_lines, palette):
+    """
+    Warp Colors, Weft Colors, Color Table, Color Palette
+    """
+    yield from iter_wif_thread_colors(need_warpcolor, warp_color_lines, need_weftcolor, weft_color_lines)
+    yield from iter_wif_palette(palette)
+
+def build_wif_colors(need_warpcolor, warp_colors,
+                     need_weftcolor, weft_colors, palette):
+    return "".join(iter_wif_colors(need_warpcolor, [warp_colors + "\n"],
+                                   need_weftcolor, [weft_colors + "\n"], palette))
+
+def gather_pieces(pieces, count=1024):
+    """
+    Join a stream of small strings into fewer, larger blocks.
+    """
+    block = []
+    for piece in pieces:
+        block.append(piece)
+        if len(block) >= count:
+            yield "".join(block)
+            block = []
+    if block:
+        yield "".join(block)
+
+def wif_color_lines(usage):
+    """
+    Yield a "thread=color" line for every thread not in the most used color.
+    - threads are numbered from 2 (as they always have been here)
+    """
+    most_used = usage.most_used
+    thread = 2
+    for color, length in usage.runs:
+        if color != most_used:
+            for i in range(thread, thread+length):
+                yield f"{i}={color}\n"
+        thread += length
 
 def build_wif_weaving(warp_frequent, weft_frequent, num_treadles, num_shafts, num_threads, num_wefts):
     """
@@ -134,6 +234,282 @@ def build_wif_weaving(warp_frequent, weft_frequent, num_treadles, num_shafts, nu
     return result
 
 
+# Each byte value with its bits in reverse order.
+reversed_bits = bytes([sum([((b >> i) & 1) << (7 - i) for i in range(8)]) for b in range(256)])
+
+def translate(data, table):
+    """ bytes of data with each byte b replaced by table[b] """
+    data = bytes(data)
+    try:
+        return data.translate(table)
+    except AttributeError:  # MicroPython has no bytes.translate
+        return bytes([table[b] for b in data])
+
+try:
+    bit_length = int.bit_length
+except AttributeError:  # MicroPython
+    def bit_length(value):
+        """ Number of bits needed for value (>= 0) """
+        return len(bin(value)) - 2 if value else 0
+
+def decode_bit_rows(chunk, size):
+    """
+    Decode a whole sequence chunk (threading, treadling, tieup, pegplan) in one go.
+    - each row is size bytes. Usually a single BE 32bit Int (up to 32 shafts),
+      or 28 bytes stored last byte first (up to 224, max used is 150).
+    - returns [max_used, rows], rows are ints with bit 0 = shaft (or treadle) 1
+    """
+    count = len(chunk) // size
+    # flip the bits in every byte so the first shaft is the low bit of its byte,
+    # then each row is just an int (byte order depends on the layout)
+    flipped = translate(chunk[:count*size], reversed_bits)
+    byteorder = 'little' if size == 4 else 'big'
+    from_bytes = int.from_bytes
+    rows = [from_bytes(flipped[start:start+size], byteorder) for start in range(0, count*size, size)]
+    # Find max bits needed to encode this pattern
+    used = 0
+    for row in rows:
+        used |= row
+    return [bit_length(used), rows]
+
+
+class BitRows(object):
+    """
+    Compact draft rows: threading, treadling, tieup or pegplan.
+    - each row is an int bitmask, bit 0 = shaft (or treadle) 1
+    - width is the number of shafts (or treadles) used
+    - active indices are worked out once per distinct row and cached
+    """
+    __slots__ = ("width", "rows", "_actives")
+
+    def __init__(self, width, rows):
+        self.width = width
+        self.rows = rows
+        self._actives = {}  # row mask: tuple of active indices
+
+    def __repr__(self):
+        return f"<BitRows: {len(self.rows)} rows x {self.width}>"
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def __getitem__(self, index):
+        return self.rows[index]
+
+    def actives(self, index):
+        """ 0 based indices of the bits set in row index """
+        mask = self.rows[index]
+        found = self._actives.get(mask)
+        if found is None:
+            found = []
+            while mask:
+                low = mask & -mask
+                found.append(bit_length(low) - 1)
+                mask ^= low
+            found = tuple(found)
+            self._actives[self.rows[index]] = found
+        return found
+
+    def first(self, index):
+        """ lowest bit set in row index, -1 if none """
+        mask = self.rows[index]
+        return bit_length(mask & -mask) - 1
+
+    def row_str(self, index):
+        """ row as a string of '0'/'1' shafts, first shaft first """
+        mask = self.rows[index]
+        return "".join(["1" if (mask >> i) & 1 else "0" for i in range(self.width)])
+
+    def transpose(self):
+        """ swap rows and columns. E.g. tieup rows are shafts, columns are treadles """
+        columns = [0] * self.width
+        for h in range(len(self.rows)):
+            bit = 1 << h
+            for i in self.actives(h):
+                columns[i] |= bit
+        return BitRows(len(self.rows), columns)
+
+
+def liftplan_treadles(pegplan, max_treadles):
+    """
+    [tieup, treadling] weaving the same as a pegplan, a treadle for each distinct lift,
+    or None if that takes more than max_treadles treadles.
+    - tieup rows are shafts, as parsed from 'u'; picks lifting nothing use no treadle
+    """
+    treadle_of = {}  # pegplan row: treadle
+    treadle_lifts = []  # shafts raised by each treadle
+    treadling = []
+    for row in pegplan:
+        if not row:
+            treadling.append(0)
+            continue
+        t = treadle_of.get(row)
+        if t is None:
+            t = len(treadle_lifts)
+            if t >= max_treadles:
+                return None
+            treadle_of[row] = t
+            treadle_lifts.append(row)
+        treadling.append(1 << t)
+    tieup = BitRows(pegplan.width, treadle_lifts).transpose()
+    return [tieup, BitRows(len(treadle_lifts), treadling)]
+
+
+class ColorUsage(object):
+    """
+    How a warp or weft color sequence uses its colors, from a single pass over it.
+    - histogram: {color index: count}
+    - indices: the colors used, in ascending order
+    - most_used, most_used_count: the most frequent color (lowest index wins a tie)
+    - runs: [color, run length] for each run of one color
+    """
+    __slots__ = ("count", "histogram", "indices", "most_used", "most_used_count", "runs")
+
+    def __init__(self, color_indices):
+        runs = []
+        previous = None
+        length = 0
+        for c in color_indices:
+            if c == previous:
+                length += 1
+            else:
+                if length:
+                    runs.append([previous, length])
+                previous = c
+                length = 1
+        if length:
+            runs.append([previous, length])
+        histogram = {}
+        for c, length in runs:
+            histogram[c] = histogram.get(c, 0) + length
+        self.count = len(color_indices)
+        self.histogram = histogram
+        self.indices = sorted(histogram)
+        self.runs = runs
+        self.most_used = None
+        self.most_used_count = 0
+        for c in self.indices:
+            if histogram[c] > self.most_used_count:
+                self.most_used, self.most_used_count = c, histogram[c]
+
+    def __repr__(self):
+        return f"<ColorUsage: {self.count} threads, {len(self.indices)} colors, {len(self.runs)} runs>"
+
+    @property
+    def uniform(self):
+        """ True if every thread is the most used color """
+        return self.most_used_count == self.count
+
+
+class Segment(object):
+    """
+    Index entry for one segment of the file.
+    - id, entity size, offset and byte length within the file contents
+    - contents are only copied when asked for (tobytes)
+    Also behaves like the [size, chunk] pair parse_wmdf used to store.
+    """
+    __slots__ = ("id", "size", "offset", "length", "buffer", "start")
+
+    def __init__(self, id, size, offset, length, buffer, start=None):
+        self.id = id
+        self.size = size
+        self.offset = offset
+        self.length = length
+        self.buffer = buffer  # memoryview of the whole file, or of just this segment
+        self.start = offset if start is None else start  # where the contents are in buffer
+
+    def __repr__(self):
+        return f"<Segment: '{self.id}' {self.count} entities of {self.size} bytes at {self.offset}>"
+
+    def __getitem__(self, index):
+        return (self.size, self.view)[index]
+
+    def __len__(self):
+        return 2
+
+    @property
+    def count(self):
+        """ number of entities in the segment """
+        return self.length // self.size if self.size else 0
+
+    @property
+    def view(self):
+        """ zero-copy view of the segment contents """
+        return self.buffer[self.start:self.start+self.length]
+
+    def tobytes(self):
+        """ materialize the segment contents """
+        return bytes(self.view)
+
+
+class Profile(object):
+    """
+    Opt-in record of where conversion time goes, pass one to parse_wmdf and WMDF.
+    - per stage (and segment id): calls, wall time, bytes, entities
+    - report() in the style of report_fstructure, as_dict() for json
+    - add() sums as_dict() results, e.g. from every file of a batch
+    Without one nothing is timed.
+    """
+    def __init__(self):
+        self.stages = {}  # "stage" or "stage id": [calls, seconds, bytes, entities]
+
+    def __repr__(self):
+        return f"<Profile: {len(self.stages)} stages, {sum([s[1] for s in self.stages.values()]):.4f}s>"
+
+    def start(self):
+        return clock()
+
+    def record(self, stage, start, id=None, nbytes=0, entities=0):
+        """ stage (for segment id) ran from start until now """
+        key = f"{stage} {id}" if id else stage
+        entry = self.stages.get(key)
+        if entry is None:
+            entry = self.stages[key] = [0, 0.0, 0, 0]
+        entry[0] += 1
+        entry[1] += seconds_since(start)
+        entry[2] += nbytes
+        entry[3] += entities
+
+    def add(self, stages):
+        """ Sum in another profile's as_dict() """
+        for key, s in stages.items():
+            entry = self.stages.get(key)
+            if entry is None:
+                entry = self.stages[key] = [0, 0.0, 0, 0]
+            entry[0] += s["calls"]
+            entry[1] += s["seconds"]
+            entry[2] += s["bytes"]
+            entry[3] += s["entities"]
+
+    def as_dict(self):
+        return {key: {"calls": s[0], "seconds": s[1], "bytes": s[2], "entities": s[3]}
+                for key, s in self.stages.items()}
+
+    def report(self):
+        """
+        Where the time went
+        """
+        msg = []
+        msg.append("Profile:")
+        msg.append(f"Report: {len(self.stages)} stages timed")
+        for key, (calls, seconds, nbytes, entities) in self.stages.items():
+            msg.append(f" - {key:<18} {calls:>4} calls  {seconds*1000:>9.3f} ms  (bytes:{nbytes}  entities:{entities})")
+        return msg
+
+
+def colorway_count(table):
+    """ How many colorways setup_colorC will find in the 'C' table """
+    if not table:
+        return 0
+    chips = sum(table[1:7])
+    if not chips:
+        return 0
+    return len(range(7, len(table), chips))
+
+
 class WMDF(object):
     """
     Given the contents of the file as a bytearray:
@@ -141,15 +517,58 @@ class WMDF(object):
     - report,
     - save as a wif file.
     """
-    def __init__(self, data, colors, filename, verbose=False):
+    def __init__(self, data, colors, filename, verbose=False, profile=None, lazy=False, treadle_limit=None):
         self.data = data
         self.colors = colors
         self.filename = filename
+        self.verbose = verbose
+        self.profile = profile  # a Profile to time the work in, or None
         self.wif = None  # wif will go here
         self.wif_filename = None  # new wif filename will go here
         self.conversion_notes = []
         self.warnings = []  # if it didn't go right - add a note in here.
-        #
+        self.liftplan = 'p' in data
+        self.treadle_limit = treadle_limit  # write a liftplan as tieup + treadling if it fits this many treadles
+        self.treadled = {}  # treadle_limit: liftplan_treadles result
+        self.loaded = ()  # loaders run so far
+        if not lazy:
+            if profile:
+                start = profile.start()
+            self.load()
+            if profile:
+                profile.record("WMDF", start)
+
+    # Attribute: the loader that works it out. When lazy, on first use.
+    lazy_attributes = {}
+    for name in ["shaft_count", "threading", "taw", "trompaswrit", "weft_count", "treadling", "treadle_count",
+                 "tieup_treadles", "tieup", "tieup_height", "pegplan_width", "pegplan", "pegplan_height"]:
+        lazy_attributes[name] = "load_weave"
+    for name in ["name", "version", "comments", "remarks", "username"]:
+        lazy_attributes[name] = "load_text"
+    for name in ["warp_colors", "warp_usage", "warp_c_indices", "color_taw", "weft_colors", "weft_usage",
+                 "weft_c_indices", "colorway", "c_mapping"]:
+        lazy_attributes[name] = "load_colorways"
+    del name
+
+    def __getattr__(self, name):
+        # only called for attributes not yet set
+        loader = WMDF.lazy_attributes.get(name)
+        if loader is None or loader in self.loaded:
+            raise AttributeError(name)
+        self.loaded = self.loaded + (loader,)  # a new tuple, copies don't share it
+        getattr(self, loader)()
+        return getattr(self, name)
+
+    def load(self):
+        """ Work out everything now (conversion notes and warnings are complete after this) """
+        for loader in ["load_weave", "load_text", "load_colorways"]:
+            if loader not in self.loaded:
+                self.loaded = self.loaded + (loader,)
+                getattr(self, loader)()
+
+    def load_weave(self):
+        """ Threading, treadling, tieup and pegplan """
+        verbose = self.verbose
         self.treadle_count = 0   # might not be any
         #self.weft_count = 0      # might not be any
         self.tieup_treadles = 0  # might not be any
@@ -171,8 +590,8 @@ class WMDF(object):
                                       "Alas cannot support this - so have simply repeated weft.",
                                       "The result is NOT as defined in the original file."])
             # replicate threading in treadling
-            self.weft_count, self.treadling = self.shaft_count, self.threading
-            self.treadle_count = len(self.threading)
+            self.weft_count, self.treadling = len(self.threading), self.threading
+            self.treadle_count = self.shaft_count
         else:  # no taw
             # Load Treadling as usual
             treadling = self.parse_sequence('r')
@@ -195,13 +614,13 @@ class WMDF(object):
             self.weft_count = len(self.pegplan)
             if verbose:
                 print(f"Pegplan: {self.pegplan_width} treadles, {len(self.pegplan)} weft threads")
-        #
-        self.liftplan = True if pegplan else False
         #! logic to test all dimensions agree but we don't really need to maybe for wif ??
         # if verbose:
         #print("Check:\n - shafts=",self.shaft_count, "tieup_height =:",self.tieup_height, "weftcount:",self.weft_count)
         #print(" - treadles=", self.treadle_count, "pegplan=", self.pegplan_width, "tieup_treadles =",self.tieup_treadles)
-        #
+
+    def load_text(self):
+        """ Name, version, comments, remarks """
         self.name = self.parse_text('n')
         self.version = self.parse_text('D')
         self.comments = self.parse_text('Y')
@@ -210,24 +629,35 @@ class WMDF(object):
             self.remarks = ""
         #print(self.remarks)
         self.username = self.parse_text('g')
+
+    def load_colorways(self):
+        """ Warp and weft colors, and the colorway mappings """
+        profile = self.profile
         # warp colors, weft colors
         self.warp_colors = self.parse_index('s')
-        self.warp_c_indices = list(set(self.warp_colors))
+        self.warp_usage = ColorUsage(self.warp_colors)
+        self.warp_c_indices = self.warp_usage.indices
         # do we have color trmp as writ set
         self.color_taw = self.parse_text('T')
         if self.color_taw:
             # color tromp as writ is set
             # there is no weft color - copy warp
             self.weft_colors = self.warp_colors
+            self.weft_usage = self.warp_usage
             self.weft_c_indices = self.warp_c_indices
             self.conversion_notes.append("Color tromp-as-writ selected. Warp colors copied to weft colors.")
         else:
             # load weft colors as usual
             self.weft_colors = self.parse_index('q') # if weft missing - copy warps (taw color)
-            self.weft_c_indices = list(set(self.weft_colors))
+            self.weft_usage = ColorUsage(self.weft_colors)
+            self.weft_c_indices = self.weft_usage.indices
         #self.majminacc = self.parse_index('A')  # unused
         self.colorway = self.parse_index('C')
+        if profile:
+            colorC_start = profile.start()
         self.c_mapping = self.setup_colorC(self.colorway, self.colors)
+        if profile:
+            profile.record("setup_colorC", colorC_start, entities=len(self.c_mapping))
         # self.lookup_ColorM(self.parse_index('M'), self.colors)  # unused
         # EPI, PPI
         # print(self.parse_EPI_PPI('e'))
@@ -237,16 +667,73 @@ class WMDF(object):
         # print(a)
         # print(b)
         # reed, beaming, denting,
-        
-        
+
+    def lifts(self):
+        """
+        Mask of the shafts raised on each pick (bit 0 = shaft 1),
+        from the liftplan, or the tieup and treadling.
+        """
+        if self.liftplan:
+            return list(self.pegplan)
+        treadling = getattr(self, "treadling", None)
+        tieup = getattr(self, "tieup", None)
+        if treadling is None or tieup is None:
+            return []
+        treadle_shafts = list(tieup.transpose())
+        lifted = {}  # treadling row: shafts raised
+        rows = []
+        for i in range(len(treadling)):
+            row = treadling[i]
+            if row not in lifted:
+                mask = 0
+                for t in treadling.actives(i):
+                    if t < len(treadle_shafts):
+                        mask |= treadle_shafts[t]
+                lifted[row] = mask
+            rows.append(lifted[row])
+        return rows
+
+    def liftplan_as_treadles(self):
+        """
+        [tieup, treadling] to write the liftplan as, when treadle_limit is set and
+        it fits, else None (write the liftplan, or the draft's own tieup)
+        """
+        if not self.liftplan or not self.treadle_limit:
+            return None
+        if self.treadle_limit not in self.treadled:
+            self.treadled[self.treadle_limit] = liftplan_treadles(self.pegplan, self.treadle_limit)
+        return self.treadled[self.treadle_limit]
+
+    def summary(self):
+        """
+        Name, version and counts from the segment headers and text alone.
+        - no bit rows are decoded, nothing heavy is loaded
+        """
+        data = self.data
+        warps = data['t'].count if 't' in data else 0
+        if self.liftplan:
+            wefts = data['p'].count
+        elif 'R' in data:  # tromp as writ, weft repeats the warp
+            wefts = warps
+        else:
+            wefts = data['r'].count if 'r' in data else 0
+        table = self.colorway if "load_colorways" in self.loaded else self.parse_index('C')
+        return {"filename": self.filename,
+                "name": self.name,
+                "version": self.version,
+                "liftplan": self.liftplan,
+                "warps": warps,
+                "wefts": wefts,
+                "colorways": colorway_count(table),
+                "colors": len(self.colors),
+                "segments": list(data.keys())}
 
     def __repr__(self):
         mode = "Liftplan" if self.liftplan else "Tieup"
         threads = f"{len(self.threading)} warps,"
         wefts = f"{self.weft_count} wefts,"
         colorways = f"{len(self.c_mapping)} colorways,"
-        warp_map,weft_map = self.c_mapping[0]
-        colors_used = len(warp_map) + len(weft_map)
+        colors_used = len(self.warp_usage.indices) + len(self.weft_usage.indices)
         colors = f"{colors_used} colors used from {len(self.colors)} defined"
         return f"<Wmdf: {self.filename}, {mode} {threads}  {wefts} {colorways} {colors}>"
 
@@ -283,8 +770,8 @@ class WMDF(object):
             msg.append(f"A single colorway is specified,")
         else:
             msg.append(f"{len(self.c_mapping)} colorways are specified,")
-        warp_map,weft_map = self.c_mapping[0]
-        msg.append(f"{len(warp_map) + len(weft_map)} colors are used from {len(self.colors)} defined.")
+        colors_used = len(self.warp_usage.indices) + len(self.weft_usage.indices)
+        msg.append(f"{colors_used} colors are used from {len(self.colors)} defined.")
         if self.remarks:
             msg.append(f"Remarks: {self.remarks}")
         if self.comments:
@@ -300,9 +787,9 @@ class WMDF(object):
         msg.append(f"Report: {len(self.data)} segments found")
         msg.append(f" - {list(self.data.keys())}")
         for id in self.data:
-            size = self.data[id][0]
-            chunk = self.data[id][1]
-            length = len(chunk)
+            segment = self.data[id]
+            size = segment.size
+            length = segment.length
             entity_count = int(length/size)
             supported = "OK" if known[id][0] else "unparsed"
             msg.append(f" - {id}  {entity_count:>3} entities.  ({supported})  (size:{size}  bytes:{length}) {known[id][1]}")
@@ -313,12 +800,8 @@ class WMDF(object):
         Which color in indices is used most, and its count.
         - indices are ints (self.warp_color or self.weft_color)
         """
-        color_ids = list(set(color_indices))  # which colors referenced
-        frequencies = [color_indices.count(i) for i in color_ids]
-        max_freq = max(frequencies)
-        color_most_used = color_ids[frequencies.index(max_freq)]
-        # print(f"colors used:{color_ids}, max_freq:{max_freq} on color {color_most_used}")
-        return color_most_used, max_freq
+        usage = ColorUsage(color_indices)
+        return usage.most_used, usage.most_used_count
 
     def build_wif_palette(self, colorway=0):
         """
@@ -326,6 +809,8 @@ class WMDF(object):
         - return [id, [r,g,b]] sequences for warp and weft
         #! needs to fill in missing gaps using full palette
         """
+        if self.profile:
+            start = self.profile.start()
         colorgroup = self.c_mapping[colorway]
         warp_group = [p for p in colorgroup[0]]
         weft_group = [p for p in colorgroup[1]]
@@ -348,14 +833,16 @@ class WMDF(object):
         #! also wrong
         new_palette.append([len(self.colors),[0,0,0]])
         #print(new_palette)
+        if self.profile:
+            self.profile.record("build_wif_palette", start, entities=len(new_palette))
         return new_palette #warp_palette
 
-    def make_wif(self, colorway=0):
+    def iter_wif_draft(self):
         """
-        Need to create:
-        - label, make_threading
-        - make_tieup, make_treadling/liftplan
-        - num_treadles, num_shafts, warp_threadcount, weft_threadcount
+        Yield the colorway independent start of the wif:
+        - header, label, threading, notes
+        - tieup and treadling or liftplan
+        - warp and weft colors
         """
         # collect all useful fields for printing
         dirpos = self.filename.rfind('/')
@@ -363,48 +850,11 @@ class WMDF(object):
             label = self.filename[dirpos+1:]
         else:
             label = self.filename
-        threading = ""
-        for i,t in enumerate(self.threading):
-            threading += f"{i+1}={t.find('1')+1}\n"
-        threading = threading[:-1]
-        # Liftplan
-        liftplan, treadling, tieup = "","",""
-        if self.liftplan:
-            for i,p in enumerate(self.pegplan):
-                actives = [f"{i+1}" for i in range(len(p)) if p[i]=='1']
-                liftplan += f'{i+1}={",".join(actives)}\n'
-        else:  # tieup and treadling
-            for i,t in enumerate(self.treadling):
-                actives = [f"{i+1}" for i in range(len(t)) if t[i]=='1']
-                treadling += f'{i+1}={",".join(actives)}\n'
-            # swap from rows to columns
-            tieup_as_cols = []
-            for i in range(self.tieup_treadles):  # traverse treadles not shafts
-                tieup_as_cols.append("".join([self.tieup[h][i] for h in range(self.tieup_height)])) 
-            # print(tieup_as_cols) 
-            for i,t in enumerate(tieup_as_cols):
-                actives = [f"{i+1}" for i in range(len(t)) if t[i]=='1']
-                tieup += f'{i+1}={",".join(actives)}\n'
-        # color info
-        # get counts for most frequent
-        warp_color_most_used, warp_freq = self.most_common_color(self.warp_colors)
-        need_warpcolor = True if warp_freq != len(self.warp_colors) else False
-        weft_color_most_used, weft_freq = self.most_common_color(self.weft_colors)
-        need_weftcolor = True if weft_freq != len(self.weft_colors) else False
-        warp_colors = ""
-        if need_warpcolor:
-            for i,c in enumerate(self.warp_colors):
-                if c != warp_color_most_used:
-                    warp_colors += f"{i+2}={c}\n"
-            warp_colors = warp_colors[:-1]
-            # print(warp_colors, warp_color_most_used)
-        weft_colors = ""
-        if need_weftcolor:
-            for i,c in enumerate(self.weft_colors):
-                if c != weft_color_most_used:
-                    weft_colors += f"{i+2}={c}\n"
-            weft_colors = weft_colors[:-1]
-        palette = self.build_wif_palette(colorway)
+        threading = self.threading
+        threading_lines = (f"{i+1}={threading.first(i)+1}\n" for i in range(len(threading)))
+        # color info, only colors other than the most used need listing
+        need_warpcolor = not self.warp_usage.uniform
+        need_weftcolor = not self.weft_usage.uniform
         notes = [f"From: {self.filename} Weavemaker version = {self.version if self.version else '(version unknown)'}"]
         if self.comments:
             c = self.comments.splitlines()
@@ -415,28 +865,117 @@ class WMDF(object):
             notes.append("Remarks:")
             notes.extend(c)
         #
+        treadled = self.liftplan_as_treadles()
+        if treadled:
+            notes.append(f"Liftplan written as {treadled[0].width} treadles")
+        #
         # Got everything ready. So:
-        # Build the filestring
-        wif = build_wif_header(label, threading, self.liftplan, need_warpcolor, need_weftcolor)
-        wif += build_wif_notes(notes)
-        if self.liftplan:
-            wif += build_wif_liftplan(liftplan)
+        # Emit the sections in order
+        timed = self.timed
+        liftplan = self.liftplan and not treadled
+        yield from timed("wif threading", iter_wif_header(label, threading_lines, liftplan, need_warpcolor, need_weftcolor))
+        yield from timed("wif notes", [build_wif_notes(notes)])
+        if liftplan:
+            yield from timed("wif liftplan", iter_wif_liftplan(wif_actives_lines(self.pegplan)))
         else:
-            wif += build_wif_tie_treadle(tieup, treadling)
-            # print("Tieup:",tieup)
-        # colors, palette, table
-        wif += build_wif_colors(need_warpcolor, warp_colors,
-                                need_weftcolor, weft_colors, palette)
-        # weaving, warp, weft
-        if self.liftplan:
-            wif += build_wif_weaving(warp_color_most_used, weft_color_most_used,
-                                 self.shaft_count, self.shaft_count, len(self.threading), self.weft_count)
+            tieup, treadling = treadled or [self.tieup, self.treadling]
+            # swap tieup from rows(shafts) to columns(treadles)
+            yield from timed("wif treadling", iter_wif_tie_treadle(wif_actives_lines(tieup.transpose()),
+                                                                   wif_actives_lines(treadling)))
+        yield from timed("wif colors", iter_wif_thread_colors(need_warpcolor, wif_color_lines(self.warp_usage),
+                                                              need_weftcolor, wif_color_lines(self.weft_usage)))
+
+    def iter_wif_weaving(self):
+        """
+        Yield the colorway independent end of the wif: weaving, warp, weft
+        """
+        warp_color_most_used = self.warp_usage.most_used
+        weft_color_most_used = self.weft_usage.most_used
+        treadled = self.liftplan_as_treadles()
+        if treadled:
+            weaving = build_wif_weaving(warp_color_most_used, weft_color_most_used,
+                                        treadled[0].width, self.shaft_count, len(self.threading), self.weft_count)
+        elif self.liftplan:
+            weaving = build_wif_weaving(warp_color_most_used, weft_color_most_used,
+                                        self.shaft_count, self.shaft_count, len(self.threading), self.weft_count)
         else:
-            wif += build_wif_weaving(warp_color_most_used, weft_color_most_used,
-                                 self.tieup_treadles, self.shaft_count, len(self.threading), self.weft_count)
-        self.wif = wif
+            weaving = build_wif_weaving(warp_color_most_used, weft_color_most_used,
+                                        self.tieup_treadles, self.shaft_count, len(self.threading), self.weft_count)
+        yield from self.timed("wif weaving", [weaving])
+
+    def iter_wif(self, colorway=0):
+        """
+        Yield the wif for colorway one small piece at a time.
+        Need to create:
+        - label, make_threading
+        - make_tieup, make_treadling/liftplan
+        - num_treadles, num_shafts, warp_threadcount, weft_threadcount
+        """
+        yield from self.iter_wif_draft()
+        # palette and table are all that change with the colorway
+        yield from self.timed("wif palette", iter_wif_palette(self.build_wif_palette(colorway)))
+        yield from self.iter_wif_weaving()
+
+    def timed(self, stage, pieces):
+        """
+        pieces of the wif unchanged, or when profiling, joined up and timed as stage
+        """
+        if self.profile is None:
+            return pieces
+        start = self.profile.start()
+        text = "".join(pieces)
+        self.profile.record(stage, start, nbytes=len(text))
+        return (text,)
+
+    def make_wif(self, colorway=0):
+        """
+        Build the whole wif for colorway as a string in self.wif
+        """
+        if self.profile:
+            start = self.profile.start()
+        self.wif = "".join(self.iter_wif(colorway))
+        if self.profile:
+            self.profile.record("make_wif", start, nbytes=len(self.wif))
+        self.wif_filename = self.calc_wif_filename(self.filename, colorway)
+
+    def write_wif(self, fileobj, colorway=0):
+        """
+        Write the wif for colorway straight to an open file (text or binary).
+        - written in blocks, the whole wif is never held in memory
+        """
+        write = fileobj.write
+        encode = False
+        for block in gather_pieces(self.iter_wif(colorway)):
+            if encode:
+                write(block.encode('utf-8'))
+            else:
+                try:
+                    write(block)
+                except TypeError:  # binary file
+                    encode = True
+                    write(block.encode('utf-8'))
         self.wif_filename = self.calc_wif_filename(self.filename, colorway)
 
+    def make_wifs(self, colorways=None):
+        """
+        Build the wifs for several colorways (default is all of them) in one pass.
+        - the colorway independent sections are only built once
+        - returns [[wif_filename, wif], ...]
+        """
+        if colorways is None:
+            colorways = range(len(self.c_mapping))
+        if self.profile:
+            start = self.profile.start()
+        draft = "".join(self.iter_wif_draft())
+        weaving = "".join(self.iter_wif_weaving())
+        wifs = []
+        for colorway in colorways:
+            palette = "".join(self.timed("wif palette", iter_wif_palette(self.build_wif_palette(colorway))))
+            wifs.append([self.calc_wif_filename(self.filename, colorway), draft + palette + weaving])
+        if self.profile:
+            self.profile.record("make_wifs", start, nbytes=sum([len(wif) for wif_filename, wif in wifs]), entities=len(wifs))
+        return wifs
+
     def calc_wif_filename(self,filename, colorway):
         """ make new filename """
         dotpos = filename.rfind(".")
@@ -451,6 +990,14 @@ class WMDF(object):
         with open(self.wif_filename, 'w') as f:
             f.write(self.wif) 
 
+    def save_wifs(self, colorways=None):
+        """
+        Save a wif for every colorway (default all), named by calc_wif_filename
+        """
+        for wif_filename, wif in self.make_wifs(colorways):
+            with open(wif_filename, 'w') as f:
+                f.write(wif)
+
     def parse_text(self, id, verbose=False):
         """
         Contents are text
@@ -459,14 +1006,15 @@ class WMDF(object):
         if verbose:
             print("Parsing:",id, known[id][1])
         if id in self.data:
-            size = self.data[id][0]
-            chunk = self.data[id][1]
-            length = len(chunk)
-            count = len(chunk)
-            name = unpack(f"{count}s", chunk)[0]
+            if self.profile:
+                start = self.profile.start()
+            name = self.data[id].tobytes()
             if verbose:
                 print(f"    - {str(name, 'utf-8')}")
-            return str(name, 'utf-8')
+            text = str(name, 'utf-8')
+            if self.profile:
+                self.profile.record("parse_text", start, id, len(name), len(text))
+            return text
 
     def parse_index(self, id, verbose=False):
         """
@@ -476,17 +1024,20 @@ class WMDF(object):
         if verbose:
             print("Parsing:",id, known[id][1])
         if id in self.data:
-            size = self.data[id][0]
-            chunk = self.data[id][1]
-            length = len(chunk)
-            count = int(len(chunk) / size)
-            result = []
-            for i in range(count):
-                start = i*size
-                value = unpack(f">b", chunk[start:start+size])[0]
-                if verbose:
+            if self.profile:
+                start = self.profile.start()
+            segment = self.data[id]
+            count = segment.count
+            # one signed byte per entity, unpacked in one go
+            chunk = segment.view
+            if segment.size != 1:  # first byte of each entity
+                chunk = bytes([chunk[i] for i in range(0, count*segment.size, segment.size)])
+            result = list(unpack(f">{count}b", chunk))
+            if verbose:
+                for i,value in enumerate(result):
                     print("    -",i,value)
-                result.append(value)
+            if self.profile:
+                self.profile.record("parse_index", start, id, segment.length, count)
             return result
 
     def parse_EPI_PPI(self, id, verbose=False):  # unused
@@ -498,8 +1049,8 @@ class WMDF(object):
             print("Parsing:",id, known[id][1])
         if id in self.data:
             result = []
-            size = self.data[id][0]
-            chunk = self.data[id][1]
+            size = self.data[id].size
+            chunk = self.data[id].view
             length = len(chunk)
             count = int(len(chunk) / size)
             if verbose:
@@ -517,8 +1068,8 @@ class WMDF(object):
         if verbose:
             print("Parsing:",id, known[id][1])
         if id in segments:
-            size = segments[id][0]
-            chunk = segments[id][1]
+            size = segments[id].size
+            chunk = segments[id].view
             length = len(chunk)
             if len(chunk) != 1:
                 print("!!Unexpected old style threading file. unsupported")
@@ -535,41 +1086,25 @@ class WMDF(object):
         if verbose:
             print("Parsing:",id, known[id][1])
         if id in self.data:
-            size = self.data[id][0]
-            chunk = self.data[id][1]
+            if self.profile:
+                start = self.profile.start()
+            size = self.data[id].size
+            chunk = self.data[id].view
             length = len(chunk)
             count = int(len(chunk) / size)
             if verbose:
                 print(f" - entity size,count = {size},{count}, (bytes={length})")
             # usually 4, 80 byteslong, 20 wide(4*8=32)
             # 28 560 20 for 36,40,42,120 high (28*8=224) (max=150)
-            values = []
-            for i in range(count):
-                start = i*size
-                value = unpack(f">{size//4}I", chunk[start:start+size])
-                # print("    -",i,value)
-                # usually 32 or under - so a single I (4 bytes)
-                # but if over 32 then use 7x I (28 bytes) to hold data up to 150
-                if len(value) == 1:
-                    value_str = f"{bin(value[0])[2:]:>032}"  # pack leading zeroes
-                else:  # over 32 (so 28x B bytes)
-                    value = unpack(f">{size}B", chunk[start:start+size])
-                    # print("    -",i,value)
-                    value_str = ""
-                    for v in value[::-1]:  # reverse
-                        binary = f"{bin(v)[2:]:>08}"  # pack leading zeroes
-                        value_str += binary
-                    # print("    -",i,value_str, len(value_str))#, bin(value)[2:])
-                values.append(value_str)
-            # Find max bits needed to encode this pattern
-            max_used = max(c.rfind('1') for c in values) + 1
-            # clip values to max_used
-            for i,col in enumerate(values):
-                values[i] = col[:max_used]
-                if verbose:
-                    print(values[i])
+            max_used, rows = decode_bit_rows(chunk, size)
+            values = BitRows(max_used, rows)
+            if verbose:
+                for i in range(len(values)):
+                    print(values.row_str(i))
             # print("shafts=:",max_used)
-            return [max_used, values]   
+            if self.profile:
+                self.profile.record("parse_sequence", start, id, length, count)
+            return [max_used, values]
 
     def setup_colorC(self, table, colors, verbose=False):
         """
@@ -594,13 +1129,13 @@ class WMDF(object):
         # print(colorway_maps)
         max_chips = sum(colorway_sizing)
         if verbose:
-            print("Warp indices:", self.warp_c_indices)
-            print("Weft indices:", self.weft_c_indices)
+            print("Warp indices:", self.warp_usage.indices)
+            print("Weft indices:", self.weft_usage.indices)
         mappings = []
         for j,cway in enumerate(colorway_maps):
             warp_map = []
             weft_map = []
-            for i,idx in enumerate(self.warp_c_indices):
+            for i,idx in enumerate(self.warp_usage.indices):
                 # note we use i not idx as the index here
                 #print(colorway_maps[j][:warp_count],i, idx)
                 ind = colorway_maps[j][:warp_count][i]
@@ -608,7 +1143,7 @@ class WMDF(object):
                 warp_map.append([idx,warpcolor])
                 if verbose:
                     print("  warp",i,idx,"maps to", ind,"(", warpcolor,")")
-            for i,idx in enumerate(self.weft_c_indices):
+            for i,idx in enumerate(self.weft_usage.indices):
                 #print(colorway_maps[j][-weft_count:],i, idx)
                 ind = colorway_maps[j][-weft_count:][i]
                 weftcolor = colors[ind]
@@ -648,116 +1183,335 @@ def read_segment(contents, idx):
     - len is a BE 16bit Int - counting in entities to end of segment
     - id is a single char label identifier
     - size is a byte of entity length
+    - label is None if the id byte is not text
     """
-    seg_len = unpack('>H', contents[idx:idx+2])[0]
-    id = unpack('s', contents[idx+2:idx+3])[0]
-    size = unpack('b', contents[idx+3:idx+4])[0]
+    seg_len, id, size = unpack_from('>Hsb', contents, idx)
     try:
         label = str(id, 'UTF-8')
     except:
-        label = "nope"
-        print("!!!Unexpected", label)
+        label = None
     return seg_len, label, size
 
+# Resynchronising after damage: bytes that can be a segment id are marked
+known_ids = set([id.encode() for id in known])
+id_marks = bytes([1 if bytes([b]) in known_ids else 0 for b in range(256)])
+
+def chain_end(contents, i):
+    """
+    Where following segment headers from i leads.
+    - len(contents) if every header is a known id and they chain exactly to the end
+    """
+    end = len(contents)
+    while i + 4 <= end:
+        seg_len, id, size = unpack_from('>Hsb', contents, i)
+        if id not in known_ids or size < 0:
+            return i
+        i += 4 + seg_len * size
+    return i
+
+def find_segment_chain(contents, start):
+    """
+    Offset of the first header at or after start from which the segments
+    chain exactly to the end of contents, or len(contents) if there is none.
+    """
+    end = len(contents)
+    marks = translate(contents[start:], id_marks)
+    j = marks.find(b"\x01", 2)  # ids are 3rd in a header
+    while j >= 0:
+        i = start + j - 2
+        if chain_end(contents, i) == end:
+            return i
+        j = marks.find(b"\x01", j + 1)
+    return end
+
+def index_segments(contents, i, data, position=0, verbose=False, diagnostics=None):
+    """
+    Add a Segment to data for each segment in contents from i on.
+    - position is where contents starts in the file
+    - unknown or damaged stretches are skipped, to the next header the segments
+      chain from exactly to the end, and noted in diagnostics (a list, if given)
+      as {offset, id (the raw id byte, None if no header fits), skipped, message}
+    - junk can look like a header: one that does not chain to the end is only taken if
+      skipping from the end of its segment skips less than skipping it would, and one
+      running past the end only if no chain follows at all
+    """
+    end = len(contents)
+    while i < end:
+        label = None
+        resume = None
+        if end - i >= 4:
+            seg_len, label, step = read_segment(contents, i)
+        if label in known and step >= 0:
+            length = seg_len * step
+            following = i + 4 + length
+            accept = chain_end(contents, i) == end
+            if not accept and label not in data:
+                # either this segment is good and damage follows it, or the header is junk:
+                # take whichever skips less to get back to segments chaining to the end
+                resume = find_segment_chain(contents, i + 1)
+                if following <= end:
+                    accept = find_segment_chain(contents, following) - following <= resume - i
+                else:
+                    accept = resume == end  # nothing readable follows, keep what there is
+            if accept:
+                if verbose:
+                    print(position + i, seg_len, "-", label)
+                    print("       -", bytes(contents[i:i+10]))
+                if following > end and diagnostics is not None:
+                    diagnostics.append({"offset": position + i, "id": bytes(contents[i+2:i+3]), "skipped": 0,
+                                        "message": f"segment '{label}' runs past the end of the file"})
+                data[label] = Segment(label, step, position + i + 4, length, contents, i + 4)
+                i = following
+                continue
+        if resume is None:
+            resume = find_segment_chain(contents, i + 1)
+        if diagnostics is not None:
+            raw = bytes(contents[i+2:i+3]) if end - i >= 4 else None
+            if raw is None:
+                message = "unreadable segment"
+            elif label in known:
+                message = f"damaged segment '{label}'"
+            else:
+                message = f"unknown segment id 0x{raw[0]:02x}"
+            diagnostics.append({"offset": position + i, "id": raw, "skipped": resume - i, "message": message})
+        if verbose:
+            print(f"!!Skipped {resume - i} bytes at {position + i}")
+        i = resume
+    return data
+
+def report_diagnostics(diagnostics):
+    """ One line per problem parse_wmdf found """
+    return [f"At byte {d['offset']}: {d['message']}" + (f" (skipped {d['skipped']} bytes)" if d['skipped'] else "")
+            for d in diagnostics]
+
+# Layouts of the fixed parts of a 'Q' palette record, each field led by its id byte.
+color_head = Struct('>s3Hs3Hs12s')  # a: screen rgb, b: print rgb, c: date
+color_tail = Struct('>s12ss5ss5ss5ss5ss12ss12ss12ss12s')  # n..v: a float, ints, sizes
+# between them: 'd','e' (the name) to 'i', each id, signed byte size, then the value
+
+class ColorChip(object):
+    """
+    One palette color, rgb (0-255) and name.
+    - indexes like the [rgb, name] pair it replaces
+    - the rest of the record (print color, date, plies, sizes) is decoded by details()
+    """
+    __slots__ = ("rgb", "name", "block", "offset")
+
+    def __init__(self, rgb, name, block=None, offset=0):
+        self.rgb = rgb
+        self.name = name
+        self.block = block
+        self.offset = offset
+
+    def __repr__(self):
+        return repr([self.rgb, self.name])
+
+    def __getitem__(self, i):
+        return (self.rgb, self.name)[i]
+
+    def __len__(self):
+        return 2
+
+    def __iter__(self):
+        return iter((self.rgb, self.name))
+
+    def details(self):
+        """ {field id: value} for the whole record, empty for the default colors """
+        if self.block is None:
+            return {}
+        block, start = self.block, self.offset
+        head = color_head.unpack_from(block, start)
+        fields = {'a': head[1:4], 'b': head[5:8], 'c': str(head[9], 'utf-8')}
+        start += color_head.size
+        for id in "defghi":
+            size = block[start+1]  # unsigned, as read_colors reads it
+            value = bytes(block[start+2:start+2+size])
+            fields[id] = str(value, 'utf-8') if id in "de" else unpack(f'{size}b', value)
+            start += 2 + size
+        tail = color_tail.unpack_from(block, start)
+        for k, id in enumerate("nopqrstuv"):
+            value = tail[2*k+1]
+            fields[id] = str(value, 'utf-8') if len(value) == 5 else value
+        return fields
+
+
 def read_colors(block, verbose=False):
     """
     Color block starts at 3rd byte in file.
     - rgb screen colors in 'a' and print in 'b'
     - description in following structure: 'd','e'
     Values are defined in 65535 space
-    - rest ignored.
-    """
-    assert('Q' == chr(block[0]))  # followed by a half of dubious value?
-    # fixed (a6,b6,c12), (n12,05,p5,q5,o5,s12,t12,u12,v12)
-    # +bytecount = (d,e,f,g,h,i)
-    colors = [[[255,255,255],"WHITE"], [[0,0,0],"BLACK"]]
-    parts = {'a':[6],'b':[6],'c':[12],  # screen color, print color, creation date
-             # defghi = names of variable length
-             'j':[12],'k':[12],'l':[12],'m':[12],  # 12 bit floats
-             'n':[12],  # n is a float
-             'o':[5],'p':[5],'q':[5],'r':[5],  # ints
-             's':[12],'t':[12],'u':[12],'v':[12]}  # sizes
+    - rest left in the block, see ColorChip.details()
+    """
+    if not len(block) or block[0] != ord('Q'):  # followed by a half of dubious value?
+        raise ValueError("Color block does not start with 'Q'")
+    colors = [ColorChip([255,255,255], "WHITE"), ColorChip([0,0,0], "BLACK")]
+    head_unpack, head_size, tail_size = color_head.unpack_from, color_head.size, color_tail.size
     start = 3 # 'a'
-    if start == len(block):
-        # nothing here
-        return colors
-    collection = []
-    # print(len(block),start)#chr(block[start])
-    assert('a' == chr(block[start]))
-    while start < len(block):
-        abc = []
-        for id in ['a','b','c']:
-            size = parts[id][0]
-            if id == 'c':  # a date
-                value = unpack(f"{size}s", block[start+1:start+1+size])[0]
-                abc.append(str(value, 'utf-8'))
-            else: # color = 3 H (unisigned ints)
-                abc.append(unpack(f'>3H', block[start+1:start+1+size]))
-            start += 1 + size
-        # print("abc:",abc)
-        # now unpack the variable length text fields
-        defghi = []
-        for id in ['d','e','f','g','h','i']:
-            # print(chr(block[start]))
-            assert(id == chr(block[start]))
-            size = unpack('b', block[start+1:start+2])[0]
-            if id in ['d','e']:
-                value = unpack(f'{size}s', block[start+2:start+2+size])[0]
-                value = str(value, 'utf-8')
-            else:
-                value = unpack(f'{size}b', block[start+2:start+2+size])
-            #print(id,size,value)
-            defghi.append(value)
+    end = len(block)
+    records = []  # [offset, screen rgb, name]
+    while start < end:
+        offset = start
+        head = head_unpack(block, start)
+        if head[0] != b'a' or head[4] != b'b' or head[8] != b'c':
+            raise ValueError(f"Bad color record at {offset}")
+        start += head_size
+        # variable length fields, only the name is kept
+        name = ""
+        for k, id in enumerate(b"defghi"):
+            if block[start] != id:
+                raise ValueError(f"Bad color record at {offset}, expected '{chr(id)}'")
+            size = block[start+1]
+            if k < 2:  # 'd','e'
+                name += str(bytes(block[start+2:start+2+size]), 'utf-8')
             start += 2 + size
-        # print("defghi:",defghi)
-        # now unpack the remaining fixed length fields
-        n_to_v = []
-        for id in ['n','o','p','q','r','s','t','u','v']:
-            size = parts[id][0]
-            if size == 5:
-                value = unpack(f"{size}s", block[start+1:start+1+size])[0]
-                n_to_v.append(str(value, 'utf-8'))
-            else:  # size=12
-                n_to_v.append(unpack(f'>12s', block[start+1:start+1+size]))
-            start += 1 + size
-        # print("n_to_v:",n_to_v)
-        collection.append([abc,defghi,n_to_v])
-    # print("collection:")
-    # for c in collection: print("  ",c)
-    # Create rgb colors
-    for i,c in enumerate(collection):
-        rgb = [int(val/65536*256) for val in c[0][0]]
-        name = c[1][0] + c[1][1]
-        colors.append([rgb, name])
+        start += tail_size
+        if start > end:
+            raise ValueError(f"Color record at {offset} runs past the block")
+        records.append([offset, head[1:4], name])
+    # 16 bit to 8 bit in one go, val >> 8 == int(val/65536*256)
+    levels = [val >> 8 for r in records for val in r[1]]
+    for i, r in enumerate(records):
+        rgb = levels[3*i:3*i+3]
+        colors.append(ColorChip(rgb, r[2], block, r[0]))
         if verbose:
-            print(f"{i+1}: {rgb}  {name}")
+            print(f"{i+1}: {rgb}  {r[2]}")
     return colors
     
 
-def parse_wmdf(contents, verbose=False):
+def parse_wmdf(contents, verbose=False, profile=None, diagnostics=None):
     """
     Given the bytearray of the file:
-    - extract all the segments into a dictionary
-    - data[id] = [entity bytesize, array_of_entities]
-    """
-    datastart = unpack('>H', contents[0:2])[0]
-    colors = read_colors(contents[2:datastart+4])
-    i = datastart + 4
-    data = {}
-    while i < len(contents):
-        seg_len, label, step = read_segment(contents, i)
-        if label in known:
-            if verbose:
-                print(i, seg_len, "-", label)
-                print("       -", contents[i:i+10])
-            next = i+4+ (seg_len * step)
-            data[label] = [step, contents[i+4:next]]
-            i = next
-        else:
-            print(f"!!FAIL: {i} {seg_len} - '{label}'")
-            i += 1
+    - index all the segments into a dictionary
+    - data[id] = Segment (behaves like [entity bytesize, array_of_entities])
+    - profile: a Profile to time the stages in
+    - diagnostics: a list to collect damaged or unknown stretches of the file in
+    Nothing is copied, segments are views into contents.
+    """
+    if profile:
+        start = profile.start()
+    contents = memoryview(contents)
+    datastart = unpack_from('>H', contents, 0)[0]
+    colors = timed_read_colors(contents[2:datastart+4], profile)
+    data = index_segments(contents, datastart + 4, {}, 0, verbose, diagnostics)
+    if profile:
+        profile.record("parse_wmdf", start, nbytes=len(contents), entities=len(data))
     return data, colors
 
+def read_summary(contents, filename=""):
+    """
+    WMDF.summary() of the file's contents, without decoding any bit rows.
+    """
+    data, colors = parse_wmdf(contents)
+    return WMDF(data, colors, filename, lazy=True).summary()
+
+def timed_read_colors(block, profile=None):
+    """ read_colors, recorded in profile if there is one """
+    if not profile:
+        return read_colors(block)
+    start = profile.start()
+    colors = read_colors(block)
+    profile.record("read_colors", start, nbytes=len(block), entities=len(colors)-2)
+    return colors
+
+
+class WMDFParser(object):
+    """
+    parse_wmdf for contents arriving in chunks (file reads, sockets, browser streams).
+    - feed(chunk) returns the Segments completed by it, so work can start before the rest arrives
+    - a file without a color block raises ValueError as soon as its header arrives
+    - close() returns data, colors as parse_wmdf does
+    Each Segment keeps a copy of its own bytes, nothing already parsed is held on to.
+    A segment is completed once the header after it has arrived (the last one by close()).
+    After damage the rest of the file is kept, and indexed by close() like parse_wmdf.
+    """
+    def __init__(self, verbose=False, profile=None, diagnostics=None):
+        self.verbose = verbose
+        self.profile = profile
+        self.diagnostics = diagnostics
+        self.damaged = False
+        self.pending = bytearray()  # arrived but not parsed yet
+        self.position = 0  # offset in the file of pending[0]
+        self.size = 0  # bytes fed so far
+        self.datastart = None
+        self.colors = None
+        self.data = {}
+
+    def __repr__(self):
+        return f"<WMDFParser: {self.size} bytes, {len(self.data)} segments>"
+
+    def feed(self, chunk):
+        """ Add the next chunk of the file, returns the Segments it completed """
+        pending = self.pending
+        pending.extend(chunk)
+        self.size += len(chunk)
+        segments = []
+        i = 0
+        if self.colors is None:
+            if self.datastart is None:
+                if len(pending) < 3:
+                    return segments
+                if pending[2] != ord('Q'):
+                    raise ValueError("Not a WeaveMaker file (no color block)")
+                self.datastart = unpack_from('>H', pending, 0)[0]
+            i = self.datastart + 4
+            if len(pending) < i:
+                return segments
+            self.colors = timed_read_colors(bytes(pending[2:i]), self.profile)
+        while not self.damaged and len(pending) - i >= 4:
+            seg_len, label, step = read_segment(pending, i)
+            if label in known and step >= 0:
+                length = seg_len * step
+                following = i + 4 + length
+                if len(pending) < following + 4:
+                    break  # rest of the segment, or the header after it, still to come
+                # junk can look like a header, so a segment is only taken once the next header reads too
+                next_len, next_label, next_step = read_segment(pending, following)
+                if next_label not in known or next_step < 0:
+                    self.damaged = True
+                    break
+                if self.verbose:
+                    print(self.position + i, seg_len, "-", label)
+                    print("       -", bytes(pending[i:i+10]))
+                payload = memoryview(bytes(pending[i+4:i+4+length]))
+                segment = Segment(label, step, self.position + i + 4, length, payload, 0)
+                self.data[label] = segment
+                segments.append(segment)
+                i = following
+            else:
+                self.damaged = True  # resynchronising needs the rest of the file
+        if i:  # a new buffer: slice deletion is not certain to work in MicroPython
+            self.pending = pending[i:]
+        self.position += i
+        return segments
+
+    def close(self):
+        """ data, colors once the whole file has been fed """
+        if self.colors is None:
+            raise ValueError(f"File ends part way through (after {self.size} bytes)")
+        if self.pending:
+            index_segments(memoryview(bytes(self.pending)), 0, self.data, self.position,
+                           self.verbose, self.diagnostics)
+            self.pending = bytearray()
+        return self.data, self.colors
+
+def parse_wmdf_file(fileobj, chunk_size=65536, verbose=False, profile=None, diagnostics=None):
+    """ parse_wmdf reading fileobj (binary) a chunk at a time """
+    parser = WMDFParser(verbose, profile, diagnostics)
+    while True:
+        chunk = fileobj.read(chunk_size)
+        if not chunk:
+            break
+        parser.feed(chunk)
+    return parser.close()
+
+async def parse_wmdf_chunks(chunks, verbose=False, profile=None, diagnostics=None):
+    """ parse_wmdf from an async iterator of byte chunks (an upload, a browser stream) """
+    parser = WMDFParser(verbose, profile, diagnostics)
+    async for chunk in chunks:
+        parser.feed(chunk)
+    return parser.close()
+
 
 if __name__ == "__main__":
     # filename = "./WMDF_WIF/W-24point+8borderH-waves.wmdf" # no treadling
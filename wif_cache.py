@@ -0,0 +1,171 @@
+#wif_cache
+
+# Content addressed cache of conversions.
+#  - keyed on a hash of the file contents (plus filename, colorway and converter version
+#    for rendered wifs, as the filename ends up inside the wif)
+#  - parsed drafts (WMDF) and rendered wifs are held in memory, least recently used
+#    entries are evicted past the entry and byte limits
+#  - rendered wifs can also be kept in a directory, so later runs skip all the work
+# A hit on a rendered wif never parses the file.
+# hits/misses count rendered wifs, draft_hits/draft_misses the parsed drafts (also those
+# a wif miss renders from), so one cold conversion is one miss of each.
+
+import os
+import copy
+import json
+import hashlib
+from collections import OrderedDict
+
+from weavemaker import __version__, parse_wmdf, WMDF
+
+
+def content_digest(contents):
+    """ Hash of the file contents """
+    return hashlib.sha256(contents).hexdigest()
+
+
+class ConversionCache(object):
+    """
+    LRU cache of parsed drafts and rendered wifs, with an optional on-disk store.
+    - max_entries, max_bytes limit the in-memory part
+    - directory (optional) holds rendered wifs as json files
+    """
+    def __init__(self, max_entries=256, max_bytes=64*1024*1024, directory=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.directory = directory
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.entries = OrderedDict()  # key: [size, value]
+        self.size = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.draft_hits = 0
+        self.draft_misses = 0
+        self.evictions = 0
+
+    def __repr__(self):
+        return f"<ConversionCache: {len(self.entries)} entries, {self.size} bytes, {self.hits} hits, {self.misses} misses>"
+
+    def __len__(self):
+        return len(self.entries)
+
+    def stats(self):
+        """ Counters as a dict """
+        return {"entries": len(self.entries), "bytes": self.size, "hits": self.hits,
+                "disk_hits": self.disk_hits, "misses": self.misses, "draft_hits": self.draft_hits,
+                "draft_misses": self.draft_misses, "evictions": self.evictions}
+
+    def report_stats(self):
+        msg = []
+        msg.append("Conversion cache:")
+        msg.append(f" - {len(self.entries)} entries, {self.size} bytes in memory")
+        msg.append(f" - {self.hits} hits ({self.disk_hits} from disk), {self.misses} misses, {self.evictions} evictions")
+        msg.append(f" - drafts: {self.draft_hits} hits, {self.draft_misses} misses")
+        return msg
+
+    ### memory LRU
+    def lookup(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        self.entries.move_to_end(key)
+        return entry[1]
+
+    def store(self, key, value, size):
+        if key in self.entries:
+            self.size -= self.entries.pop(key)[0]
+        if size > self.max_bytes:
+            return  # would evict everything else
+        self.entries[key] = [size, value]
+        self.size += size
+        while len(self.entries) > self.max_entries or self.size > self.max_bytes:
+            old_size, old_value = self.entries.popitem(last=False)[1]
+            self.size -= old_size
+            self.evictions += 1
+
+    def clear(self):
+        self.entries.clear()
+        self.size = 0
+
+    ### disk store
+    def disk_path(self, key):
+        return os.path.join(self.directory, key + ".json")
+
+    def disk_load(self, key):
+        if not self.directory:
+            return None
+        try:
+            with open(self.disk_path(key), encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def disk_save(self, key, value):
+        if not self.directory:
+            return
+        path = self.disk_path(key)
+        temp = f"{path}.{os.getpid()}.tmp"  # other processes may share the directory
+        with open(temp, 'w', encoding='utf-8') as f:
+            json.dump(value, f)
+        os.replace(temp, path)
+
+    ### conversions
+    def wif_key(self, digest, filename, colorway):
+        """ colorway is an index, or "all" """
+        name = f"{digest}|{__version__}|{colorway}|{filename}"
+        return hashlib.sha256(name.encode('utf-8')).hexdigest()
+
+    def rendered(self, key, render):
+        """ Memory, then disk, then render() a wif value """
+        value = self.lookup(key)
+        if value is not None:
+            self.hits += 1
+            return value
+        value = self.disk_load(key)
+        if value is not None:
+            self.hits += 1
+            self.disk_hits += 1
+        else:
+            self.misses += 1
+            value = render()
+            self.disk_save(key, value)
+        self.store(key, value, sum([len(wif) for wif_filename, wif in value]))
+        return value
+
+    def get_draft(self, contents, filename, digest=None):
+        """
+        Parsed draft (WMDF) for contents.
+        - drafts are shared between filenames, the copy returned has this filename
+        """
+        digest = digest or content_digest(contents)
+        key = f"draft|{digest}|{__version__}"
+        draft = self.lookup(key)
+        if draft is None:
+            self.draft_misses += 1
+            data, colors = parse_wmdf(contents)
+            draft = WMDF(data, colors, filename)
+            # segments are views into contents, so that is about what a draft holds
+            self.store(key, draft, len(contents))
+        else:
+            self.draft_hits += 1
+        if draft.filename != filename:
+            draft = copy.copy(draft)
+            draft.filename = filename
+        return draft
+
+    def get_wif(self, contents, filename, colorway=0):
+        """ [wif_filename, wif] for one colorway """
+        digest = content_digest(contents)
+        def render():
+            draft = self.get_draft(contents, filename, digest)
+            return draft.make_wifs([colorway])
+        return self.rendered(self.wif_key(digest, filename, colorway), render)[0]
+
+    def get_wifs(self, contents, filename):
+        """ [[wif_filename, wif], ...] for all colorways """
+        digest = content_digest(contents)
+        def render():
+            return self.get_draft(contents, filename, digest).make_wifs()
+        return self.rendered(self.wif_key(digest, filename, "all"), render)
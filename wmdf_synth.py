@@ -0,0 +1,204 @@
+#wmdf_synth
+
+# Synthetic WeaveMaker (wmdf) file generator.
+# Writes byte streams in the layout parse_wmdf reads (see notes in weavemaker.py):
+#  - 2 byte BE offset past the 'Q' color palette block,
+#  - palette records 'a'..'v' (rgb in 65535 space, names, unused fields),
+#  - segments of (2 byte BE entity count, id char, entity size byte, entities).
+# Threading, treadling, tieup and pegplan rows are a single BE 32bit Int for up to 32
+# shafts (or treadles), or 28 bytes stored last byte first for more (up to 224).
+# Used for benchmarks and the test corpus - no real draft files needed.
+#
+# Usage:
+#   python wmdf_synth.py out.wmdf [--shafts 8] [--picks 400] [--liftplan] ...
+
+import sys
+import random
+import argparse
+from struct import pack
+
+max_colorways = 5   # WeaveMaker limits
+max_palette = 40
+max_chips = 14      # warp + weft chips in one colorway
+junk_ids = b"tnrupsqCDYgRT"  # segment ids, so random damage looks like segment headers
+
+
+def text_segment(id, text):
+    """ Text segment, one byte entities """
+    contents = text.encode('utf-8')
+    return pack('>Hcb', len(contents), id.encode(), 1) + contents
+
+def index_segment(id, values):
+    """ Segment of signed byte entities. E.g. warp colors, colorways """
+    return pack('>Hcb', len(values), id.encode(), 1) + pack(f">{len(values)}b", *values)
+
+def row_size(width):
+    """ Bytes per threading/treadling row for this many shafts or treadles """
+    if width <= 32:
+        return 4
+    if width <= 224:
+        return 28
+    raise ValueError(f"{width} shafts or treadles is more than a wmdf can hold")
+
+def sequence_segment(id, rows, width):
+    """
+    Threading, treadling, tieup or pegplan segment.
+    - rows are lists of active 0 based indices
+    """
+    size = row_size(width)
+    chunk = bytearray()
+    for actives in rows:
+        value = 0
+        for a in actives:
+            value |= 1 << a
+        if size == 4:  # BE Int, first shaft is the high bit
+            value = int(f"{value:032b}"[::-1], 2)
+            chunk += pack('>I', value)
+        else:  # first shaft is the high bit of the last byte
+            bits = f"{value:0{size*8}b}"[::-1]
+            chunk += bytes([int(bits[i:i+8], 2) for i in range(0, size*8, 8)][::-1])
+    return pack('>Hcb', len(rows), id.encode(), size) + bytes(chunk)
+
+def color_record(rgb, name):
+    """
+    One palette record.
+    - a,b = screen and print rgb (65535 space), c = datestamp
+    - d,e = name in two parts, f..i = unused variable length fields
+    - n..v = unused fixed length fields
+    """
+    rgb16 = [c * 257 for c in rgb]
+    record = b'a' + pack('>3H', *rgb16) + b'b' + pack('>3H', *rgb16) + b'c' + b"200001011200"
+    half = len(name) // 2
+    for id, value in zip("defghi", [name[:half].encode('utf-8'), name[half:].encode('utf-8'), b"", b"", b"", b""]):
+        record += pack('>cb', id.encode(), len(value)) + value
+    for id in "nopqrstuv":
+        size = 5 if id in "opqr" else 12
+        record += id.encode() + b"0" * size
+    return record
+
+def palette_block(colors):
+    """ 2 byte offset to the segments, then the 'Q' block of color records """
+    records = b"".join([color_record(rgb, name) for rgb, name in colors])
+    block = b'Q' + b'\x00\x00' + records
+    return pack('>H', len(block) - 2) + block
+
+def point_sequence(length, width, rnd, noise=0.0):
+    """ Point (or straight) draw repeated to length, 0 based. With a little noise. """
+    if width == 1:
+        cycle = [0]
+    elif rnd.random() < 0.5:
+        cycle = list(range(width))
+    else:
+        cycle = list(range(width)) + list(range(width-2, 0, -1))
+    result = [cycle[i % len(cycle)] for i in range(length)]
+    for i in range(length):
+        if rnd.random() < noise:
+            result[i] = rnd.randrange(width)
+    result[0] = width - 1  # make sure all of the width is used
+    return result
+
+def stripes(length, chips, rnd):
+    """ Color index sequence as stripes of random widths """
+    result = []
+    while len(result) < length:
+        result.extend([rnd.randrange(chips)] * rnd.randint(1, 12))
+    result = result[:length]
+    result[:chips] = list(range(chips))[:length]  # every chip used
+    return result
+
+def make_wmdf(shafts=8, treadles=8, ends=200, picks=200, colorways=1, palette=8,
+              liftplan=False, warp_chips=3, weft_chips=2, noise=0.0, seed=0,
+              name="Synthetic", remarks="Made by wmdf_synth", tromp="", color_tromp=False, damage=0,
+              random_damage=False, chip_indices=None):
+    """
+    Bytes of a synthetic wmdf file.
+    - shafts, treadles: up to 32 use the 4 byte layout, more the 28 byte one
+    - liftplan: write a pegplan ('p') instead of treadling + tieup ('r','u')
+    - noise: fraction of threading/treadling entries chosen at random
+    - tromp: 'n' (or 'v' for tabby) writes tromp as writ instead of a treadling,
+      color_tromp leaves out the weft colors, the warp's are used
+    - damage: that many junk bytes before the name segment, for the parser to skip,
+      0xff unless random_damage, then seeded random bytes, about half of them segment ids
+    - chip_indices: the color index written for each chip (default 0, 1, ..), sparse
+      indices such as [3, 9] check the order colorway chips are matched in
+    """
+    if not 1 <= colorways <= max_colorways:
+        raise ValueError(f"colorways must be 1..{max_colorways}")
+    if not 0 <= palette <= max_palette:
+        raise ValueError(f"palette must be 0..{max_palette}")
+    if warp_chips + weft_chips > max_chips or min(warp_chips, weft_chips) < 1:
+        raise ValueError(f"1 or more warp and weft chips, at most {max_chips} together")
+    rnd = random.Random(seed)
+    colors = [[[rnd.randrange(256) for c in range(3)], f"color {i+1}"] for i in range(palette)]
+    contents = palette_block(colors)
+    threading = point_sequence(ends, shafts, rnd, noise)
+    contents += sequence_segment('t', [[s] for s in threading], shafts)
+    treadling = point_sequence(picks, treadles, rnd, noise)
+    if tromp:
+        treadling = threading
+    # twill tieup, each treadle lifts half the shafts
+    tieup = [[t for t in range(treadles) if (s - t) % shafts < max(1, shafts // 2)] for s in range(shafts)]
+    if liftplan:
+        lifts = [[s for s in range(shafts) if t in tieup[s]] for t in range(treadles)]
+        pegplan = [lifts[t] for t in treadling]
+        pegplan[0] = pegplan[0] + [shafts - 1]  # all shafts used
+        contents += sequence_segment('p', pegplan, shafts)
+    elif tromp:
+        contents += text_segment('R', tromp)
+        contents += sequence_segment('u', tieup, treadles)
+    else:
+        contents += sequence_segment('r', [[t] for t in treadling], treadles)
+        contents += sequence_segment('u', tieup, treadles)
+    if random_damage:
+        contents += bytes([rnd.choice(junk_ids) if rnd.random() < 0.5 else rnd.randrange(256) for i in range(damage)])
+    else:
+        contents += b'\xff' * damage
+    contents += text_segment('n', name)
+    contents += text_segment('D', "8.6.1")
+    if remarks:
+        contents += text_segment('Y', remarks)
+    contents += text_segment('g', "wmdf_synth")
+    chip_indices = chip_indices or list(range(max_chips))
+    contents += index_segment('s', [chip_indices[c] for c in stripes(ends, warp_chips, rnd)])
+    weft_colors = [chip_indices[c] for c in stripes(picks, weft_chips, rnd)]
+    if color_tromp:
+        contents += text_segment('T', "y")
+    else:
+        contents += index_segment('q', weft_colors)
+    # colorway: count, chips as (maj,min,acc) warp then weft, then chips mapping to palette
+    table = [colorways, warp_chips, 0, 0, weft_chips, 0, 0]
+    for c in range(colorways):
+        table.extend([rnd.randrange(palette + 2) for i in range(warp_chips + weft_chips)])
+    contents += index_segment('C', table)
+    contents += index_segment('e', [0, 24, 0, 1])  # unparsed, but present in real files
+    return contents
+
+def write_wmdf(filename, **options):
+    """ Write a synthetic wmdf file, returns its size """
+    contents = make_wmdf(**options)
+    with open(filename, 'wb') as f:
+        f.write(contents)
+    return len(contents)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Write a synthetic WeaveMaker wmdf file.")
+    parser.add_argument("output", help="wmdf file to write")
+    parser.add_argument("--shafts", type=int, default=8)
+    parser.add_argument("--treadles", type=int, default=8)
+    parser.add_argument("--ends", type=int, default=200, help="warp threads")
+    parser.add_argument("--picks", type=int, default=200, help="weft threads")
+    parser.add_argument("--colorways", type=int, default=1)
+    parser.add_argument("--palette", type=int, default=8, help="colors in the palette")
+    parser.add_argument("--liftplan", action="store_true", help="pegplan instead of tieup and treadling")
+    parser.add_argument("--noise", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+    size = write_wmdf(args.output, shafts=args.shafts, treadles=args.treadles, ends=args.ends,
+                      picks=args.picks, colorways=args.colorways, palette=args.palette,
+                      liftplan=args.liftplan, noise=args.noise, seed=args.seed)
+    print(f"Wrote {args.output} ({size} bytes)")
+
+
+if __name__ == "__main__":
+    sys.exit(main())